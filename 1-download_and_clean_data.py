@@ -1,28 +1,30 @@
 # This script will be used to download and process the data from the Friends TV show script.
 # It calls functions declared in the downloading_and_cleaning_func.py so the processed showed here is very summaraized.
 
-import os
-import requests
-import pandas as pd
-import kaggle
-import numpy as np
 from python_scripts import downloading_and_cleaning_func as d_c
+from python_scripts import parquet_io, text_index
+from python_scripts.pipeline import PipelineRunner
+from python_scripts.instrumentation import Instrumentation, LogSink, JsonFileSink, PrometheusSink
 
-# First we authenticate using the kaggle API.
-kaggle.api.authenticate()
+# The main guard is needed because the sentiment analysis starts worker processes that import this script again.
+if __name__ == "__main__":
+    # We use a function I delcared to download the Friends script as a .txt file, together with the Wikipedia page with the season data.
+    # It uses the Kaggle API credentials of ~/.kaggle/kaggle.json and only downloads the files that changed since the last run.
+    print(d_c.download_friends_script())
 
-# We use a function I delcared to download the Friends script as a .txt file.
-d_c.download_friends_script()
+    # Now we read the text file lazily and clean it in order to produce 3 DataFrames with information about the script, scenes/episodes and episodes/season.
+    # The pipeline runner saves the output of every step in data/checkpoints and skips the steps whose code and inputs did not change since the last run.
+    # The duration, rows and peak memory of every step are printed and saved to data/metrics.
+    instrumentation = Instrumentation([LogSink(), JsonFileSink("data/metrics/pipeline.json"), PrometheusSink("data/metrics/pipeline.prom")])
+    runner = PipelineRunner("data/checkpoints", transcript="data/Friends_Transcript.txt", instrumentation=instrumentation)
+    friends_script, f_scene_info, f_seasons = runner.run()
+    instrumentation.close()
 
-# Now we read the text file using open() so that we can turn it into a list of strings to process with the a function we defined.
-with open("data/Friends_Transcript.txt", "r") as f:
-    script = f.readlines()
+    # Exports these Dataframes to CSV files so that they can be uploades to SQL later using the uploading_to_sql.py script.
+    d_c.export_friends_info_csv(friends_script, f_seasons, f_scene_info)
 
-# Using a cleaning function we process the file so that we turn the .txt into a Pandas DF:
-friends_script = d_c.process_script(script)
+    # Also exports them as typed Parquet files, which are much faster to read back and keep the type of every column.
+    parquet_io.export_friends_info_parquet(friends_script, f_seasons, f_scene_info)
 
-# Using several functions we clean the script in order to produce 3 DataFrames with information about the script, scenes/episodes and episodes/season.
-friends_script, f_scene_info, f_seasons = d_c.clean_script(friends_script)
-
-# Exports these Dataframes to CSV files so that they can be uploades to SQL later using the uploading_to_sql.py script.
-d_c.export_friends_info_csv(friends_script, f_seasons, f_scene_info)
\ No newline at end of file
+    # Exports the inverted index of the words of the lines built by the last step of the pipeline, used to search the lines that mention a word or phrase.
+    text_index.save_index(runner.read_output("line_index"), friends_script)
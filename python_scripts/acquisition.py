@@ -0,0 +1,255 @@
+# This file declares the functions used by download_friends_script in downloading_and_cleaning_func.py to download the raw data.
+# Every download is recorded in a manifest (data/cache/downloads.json) with its ETag, Last-Modified date, size and SHA-256 checksum, so a file that did not change
+# on the server is not downloaded again. Several files are downloaded concurrently with asyncio, and a download that was interrupted is resumed
+# from where it stopped when the server supports byte ranges.
+# Any URL supported by urllib works, including file:// URLs, which can be used to test the downloads without the network.
+import os
+import json
+import time
+import base64
+import shutil
+import asyncio
+import hashlib
+import urllib.error
+import urllib.request
+import urllib.parse
+
+# Manifest with the metadata of every downloaded file
+MANIFEST_PATH = "data/cache/downloads.json"
+
+# Size of the blocks read from the network and from disk
+BLOCK_SIZE = 1 << 16
+
+## Class declaration
+
+class ChecksumError(OSError):
+    """
+    Raised when a downloaded file does not have the expected SHA-256 checksum. It is an OSError so that callers fall back to a local copy like for any other failed download.
+    """
+
+class StripAuthorizationRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """
+    Follows redirects like the default handler of urllib, but drops the Authorization header when the redirect goes to another host.
+    The Kaggle API redirects downloads to a signed storage URL, which must not receive the Kaggle credentials (requests and the kaggle command do the same).
+    """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        new_request = super().redirect_request(req, fp, code, msg, headers, newurl)
+        if new_request is not None and urllib.parse.urlsplit(newurl).hostname != urllib.parse.urlsplit(req.full_url).hostname:
+            new_request.remove_header("Authorization")
+        return new_request
+
+# Opener used for every download, with the redirect handler above instead of the default one
+OPENER = urllib.request.build_opener(StripAuthorizationRedirectHandler)
+
+## Function declaration
+
+def sha256_file(path):
+    """
+    Returns the SHA-256 checksum of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    """
+    Returns the manifest of the downloaded files, by URL. An empty manifest is returned if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """
+    Writes the manifest, first to a temporary file so that an interrupted write never leaves a broken manifest.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def kaggle_headers():
+    """
+    Returns the Authorization header for the Kaggle API, with the credentials of the KAGGLE_USERNAME and KAGGLE_KEY environment variables
+    or of ~/.kaggle/kaggle.json (the same credentials used by the kaggle command). Returns no headers if there are no credentials.
+    """
+    username, key = os.getenv("KAGGLE_USERNAME"), os.getenv("KAGGLE_KEY")
+    config_path = os.path.join(os.getenv("KAGGLE_CONFIG_DIR", os.path.expanduser("~/.kaggle")), "kaggle.json")
+    if not (username and key) and os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            config = json.load(f)
+        username, key = config.get("username"), config.get("key")
+    if not (username and key):
+        return {}
+    token = base64.b64encode(f"{username}:{key}".encode("utf-8")).decode("ascii")
+    return {"Authorization": f"Basic {token}"}
+
+def is_unchanged(record, path, etag, last_modified, size):
+    """
+    Returns True if the response describes the same file that was downloaded before: the local copy still has the recorded checksum
+    and the server sent the same ETag, or the same Last-Modified date and size when there is no ETag (e.g. file:// URLs).
+    """
+    if not record or not os.path.exists(path) or sha256_file(path) != record.get("sha256"):
+        return False
+    if etag:
+        return etag == record.get("etag")
+    return last_modified is not None and last_modified == record.get("last_modified") and size is not None and size == record.get("size")
+
+def fetch(url, path, record=None, headers=None, sha256=None, timeout=30):
+    """
+    Downloads url to path unless the file did not change since the download described by record.
+    The file is written to path + ".part" and only moved to path once it is complete and its checksum is verified. If a ".part" file is left by an
+    interrupted download, the download is resumed from its end with a Range request, as long as the file on the server did not change.
+
+    Parameters:
+    url (str): URL of the file, http(s):// or file://.
+    path (str): Where the file is saved.
+    record (dict): The manifest record of the previous download of this URL, if any.
+    headers (dict): Extra request headers, e.g. the Authorization header.
+    sha256 (str): Expected SHA-256 checksum of the file, if known.
+    timeout (float): Timeout of the connection in seconds.
+
+    Returns:
+    Tuple[dict, bool]: The new manifest record and True if the file was downloaded, False if it did not change.
+
+    Raises:
+    urllib.error.URLError if the file can not be downloaded or is incomplete, ChecksumError if its checksum is not the expected one (both are OSErrors).
+    """
+    part_path = path + ".part"
+    part_meta_path = part_path + ".json"
+    request_headers = dict(headers or {})
+
+    # Ask the server to only send the file if it changed
+    if record and os.path.exists(path):
+        if record.get("etag"):
+            request_headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            request_headers["If-Modified-Since"] = record["last_modified"]
+
+    # Resume an interrupted download if the file on the server is still the same one
+    offset = 0
+    if os.path.exists(part_path) and os.path.exists(part_meta_path):
+        with open(part_meta_path, "r") as f:
+            part_meta = json.load(f)
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            offset = os.path.getsize(part_path)
+            request_headers["Range"] = f"bytes={offset}-"
+            request_headers["If-Range"] = validator
+
+    try:
+        response = OPENER.open(urllib.request.Request(url, headers=request_headers), timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            os.utime(path)
+            return record, False
+        raise
+
+    with response:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        length = response.headers.get("Content-Length")
+        status = getattr(response, "status", None) or response.getcode()
+        resumed = status == 206 and offset > 0
+        size = offset + int(length) if resumed and length is not None else (int(length) if length is not None else None)
+
+        # Servers that ignore the conditional headers (and file:// URLs) are checked with the ETag or the date and size of the response
+        if not resumed and is_unchanged(record, path, etag, last_modified, size):
+            os.utime(path)
+            return record, False
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(part_meta_path, "w") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified}, f)
+
+        # Append to the partial file if the server sent the rest of the file, otherwise start again from the beginning
+        digest = hashlib.sha256()
+        if resumed:
+            with open(part_path, "rb") as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                    digest.update(block)
+        with open(part_path, "ab" if resumed else "wb") as f:
+            for block in iter(lambda: response.read(BLOCK_SIZE), b""):
+                digest.update(block)
+                f.write(block)
+
+    # A connection closed before the end of the file leaves the partial file, so the next call resumes the download
+    if size is not None and os.path.getsize(part_path) != size:
+        raise urllib.error.ContentTooShortError(f"Downloaded {os.path.getsize(part_path)} of {size} bytes of {url}", None)
+
+    checksum = digest.hexdigest()
+    if sha256 is not None and checksum != sha256:
+        os.remove(part_path)
+        os.remove(part_meta_path)
+        raise ChecksumError(f"The checksum of {url} is {checksum}, expected {sha256}")
+
+    os.replace(part_path, path)
+    os.remove(part_meta_path)
+    return {"url": url, "path": path, "etag": etag, "last_modified": last_modified, "size": os.path.getsize(path),
+            "sha256": checksum, "downloaded": time.strftime("%Y-%m-%dT%H:%M:%S")}, True
+
+async def fetch_async(url, path, record=None, **kwargs):
+    """
+    Runs fetch in a worker thread so that several downloads can run concurrently in the event loop.
+    """
+    return await asyncio.to_thread(fetch, url, path, record, **kwargs)
+
+async def acquire_async(sources, manifest_path=MANIFEST_PATH):
+    """
+    Downloads every source concurrently and updates the manifest. See acquire.
+    """
+    manifest = load_manifest(manifest_path)
+    tasks = [fetch_async(source["url"], source["path"], manifest.get(source["url"]),
+                         headers=source.get("headers"), sha256=source.get("sha256")) for source in sources]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    changed = {}
+    errors = []
+    for source, result in zip(sources, results):
+        if isinstance(result, BaseException):
+            # Optional sources are skipped when they fail, the caller falls back to a local copy
+            if source.get("required", True):
+                errors.append(result)
+            else:
+                print(f"Could not download {source['url']} ({result})")
+            continue
+        record, downloaded = result
+        manifest[source["url"]] = record
+        changed[source["path"]] = downloaded
+
+    # Save the downloads that succeeded before reporting the ones that failed
+    save_manifest(manifest, manifest_path)
+    if errors:
+        raise errors[0]
+    return changed
+
+def acquire(sources, manifest_path=MANIFEST_PATH):
+    """
+    Downloads the sources concurrently, skipping the files that did not change since they were recorded in the manifest.
+
+    Parameters:
+    sources (list of dict): Files to download, each with a "url" and a "path", and optionally "headers", an expected "sha256"
+        and "required" (False if a failed download should be skipped instead of raising the error).
+    manifest_path (str): Path of the manifest.
+
+    Returns:
+    dict: For the path of every source, True if it was downloaded and False if it did not change. Optional sources that failed are missing.
+    """
+    return asyncio.run(acquire_async(sources, manifest_path))
+
+def extract_zip_member(zip_path, member, path):
+    """
+    Extracts a single file of a zip archive to path.
+    """
+    import zipfile
+    with zipfile.ZipFile(zip_path) as archive, archive.open(member) as source, open(path + ".tmp", "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,171 @@
+# This file declares the queries used by the notebook as Python functions, so that the analysis can run without the MySQL server.
+# The exported Parquet files are loaded into a local SQLite database (data/friends.sqlite) with the same tables, indexes and rollup tables
+# that sql_loader.py builds in MySQL. The database is only rebuilt when the Parquet files change, and the result of every query is cached in memory.
+#
+# Every function also accepts the shared MySQL engine of sql_engine.py, e.g.:
+#   analytics.sentiment_by_season()                           # local SQLite database
+#   analytics.sentiment_by_season(sql_engine.get_engine())    # MySQL server
+import os
+import json
+import pandas as pd
+import sqlalchemy as alch
+from python_scripts import parquet_io, sql_loader, sql_engine
+
+# Path of the local database and folder of the Parquet files it is built from
+LOCAL_DATABASE = "data/friends.sqlite"
+PARQUET_FOLDER = "data/"
+
+# Characters compared in the notebook
+MAIN_CHARACTERS = ("Rachel", "Monica", "Phoebe", "Ross", "Joey", "Chandler")
+
+# Queries of the notebook, they read the rollup tables built after the upload
+QUERIES = {
+    # Average sentiment (sia_compound) of the top characters (by line count) of every season
+    "sentiment_by_character_by_season": """
+        SELECT t.season AS season, t.f_char AS charact, t.num_lines, t.sentiment AS sentiment
+            FROM (
+                    SELECT season, f_char, num_lines, sentiment,
+                        ROW_NUMBER() OVER (PARTITION BY season ORDER BY num_lines DESC) AS row_num
+                    FROM sentiment_by_season_character
+                ) t
+        WHERE t.row_num <= :top
+        ORDER BY t.season ASC, sentiment DESC""",
+    # Average sentiment (sia_compound) of every season
+    "sentiment_by_season": """
+        SELECT season, sentiment
+        FROM sentiment_by_season
+        ORDER BY sentiment DESC""",
+    # Average sentiment (sia_compound) of the given characters
+    "sentiment_by_character": """
+        SELECT f_char AS charact, num_lines, sentiment
+        FROM sentiment_by_character
+        WHERE f_char IN :characters
+        ORDER BY sentiment DESC""",
+    # Number of lines of the given characters in every season
+    "lines_per_character_per_season": """
+        SELECT season, f_char AS charact, num_lines
+        FROM sentiment_by_season_character
+        WHERE f_char IN :characters
+        ORDER BY season, num_lines DESC""",
+}
+
+# Results of the queries, by database, generation of its tables (see sql_loader.table_generations), query and parameters
+query_cache = {}
+
+## Function declaration
+
+def source_fingerprint(folder=PARQUET_FOLDER):
+    """
+    Returns the size and modification time of every Parquet file, used to know if the local database must be rebuilt.
+    """
+    fingerprint = {}
+    for name in parquet_io.TABLES:
+        stat = os.stat(os.path.join(folder, f"{name}.parquet"))
+        fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+    return json.dumps(fingerprint, sort_keys=True)
+
+def build_local_database(path=LOCAL_DATABASE, folder=PARQUET_FOLDER):
+    """
+    Loads the Parquet files into a SQLite database with the tables, indexes and rollup tables of sql_loader.upload_friends_info.
+
+    Parameters:
+    path (str): Path of the SQLite database.
+    folder (str): Folder with the Parquet files exported by 1-download_and_clean_data.py.
+
+    Returns:
+    sqlalchemy Engine: Connection to the database.
+    """
+    engine = sql_engine.get_engine(f"sqlite:///{path}")
+    friends_script, f_scene_info, f_seasons = parquet_io.read_friends_info_parquet(folder)
+    sql_loader.upload_friends_info(engine, friends_script, f_scene_info, f_seasons)
+
+    # Save the fingerprint of the files the database was built from
+    with engine.begin() as connection:
+        connection.execute(alch.text("DROP TABLE IF EXISTS build_info"))
+        connection.execute(alch.text("CREATE TABLE build_info (source TEXT)"))
+        connection.execute(alch.text("INSERT INTO build_info (source) VALUES (:source)"), {"source": source_fingerprint(folder)})
+    return engine
+
+def local_engine(path=LOCAL_DATABASE, folder=PARQUET_FOLDER):
+    """
+    Returns an engine connected to the local SQLite database, building it first if it does not exist or if the Parquet files changed since it was built.
+
+    Parameters:
+    path (str): Path of the SQLite database.
+    folder (str): Folder with the Parquet files exported by 1-download_and_clean_data.py.
+
+    Returns:
+    sqlalchemy Engine: Connection to the database.
+    """
+    engine = sql_engine.get_engine(f"sqlite:///{path}")
+
+    built_from = None
+    if os.path.exists(path):
+        with engine.connect() as connection:
+            if alch.inspect(connection).has_table("build_info"):
+                built_from = connection.execute(alch.text("SELECT source FROM build_info")).scalar()
+
+    if built_from != source_fingerprint(folder):
+        print(f"Building the local database '{path}' from the Parquet files in '{folder}'...")
+        sql_engine.dispose_engine(f"sqlite:///{path}")
+        engine = build_local_database(path, folder)
+        clear_cache()
+    return engine
+
+def clear_cache():
+    """
+    Empties the cache of query results, e.g. after another process uploaded new data to the MySQL server. Uploads of this process are detected without it.
+    """
+    query_cache.clear()
+
+def run_query(name, engine=None, **params):
+    """
+    Runs one of the QUERIES and returns its result as a DataFrame. The result is cached, so running the same query again with the same parameters
+    does not access the database, until the tables are uploaded again by sql_loader. A copy is returned so that changing the result does not change the cache.
+
+    Parameters:
+    name (str): Name of the query in QUERIES.
+    engine (sqlalchemy Engine): Database to query, defaults to the local SQLite database.
+    params: Parameters of the query, lists and tuples are expanded for IN clauses.
+
+    Returns:
+    pandas DataFrame: The result of the query.
+    """
+    engine = engine or local_engine()
+    params = {key: tuple(value) if isinstance(value, (list, tuple)) else value for key, value in params.items()}
+    url = str(engine.url)
+    key = (url, sql_loader.table_generations.get(url, 0), name, tuple(sorted(params.items())))
+
+    if key not in query_cache:
+        query = alch.text(QUERIES[name])
+        for param, value in params.items():
+            if isinstance(value, tuple):
+                query = query.bindparams(alch.bindparam(param, expanding=True))
+        with engine.connect() as connection:
+            query_cache[key] = pd.read_sql_query(query, connection, params=params)
+
+    return query_cache[key].copy()
+
+def sentiment_by_character_by_season(engine=None, top=8):
+    """
+    Returns the average sentiment (sia_compound) of the top characters (by line count) of every season.
+    """
+    return run_query("sentiment_by_character_by_season", engine, top=top)
+
+def sentiment_by_season(engine=None):
+    """
+    Returns the average sentiment (sia_compound) of every season.
+    """
+    return run_query("sentiment_by_season", engine)
+
+def sentiment_by_character(engine=None, characters=MAIN_CHARACTERS):
+    """
+    Returns the number of lines and the average sentiment (sia_compound) of the given characters.
+    """
+    return run_query("sentiment_by_character", engine, characters=characters)
+
+def lines_per_character_per_season(engine=None, characters=MAIN_CHARACTERS):
+    """
+    Returns the number of lines of the given characters in every season.
+    """
+    return run_query("lines_per_character_per_season", engine, characters=characters)
@@ -0,0 +1,299 @@
+# This file declares a benchmark suite for the download-clean-upload pipeline.
+# Every step of the pipeline is run on the Friends transcript (or a synthetic transcript built from the bundled scenes and seasons data when the transcript
+# has not been downloaded) scaled 1x, 10x and 100x. Wall time, peak RSS and rows/sec are saved as JSON and compared with a stored baseline to flag regressions.
+#
+# It can be run from the command line, e.g.:
+#   python -m python_scripts.benchmark --scales 1 10
+#   python -m python_scripts.benchmark --scales 1 --save-baseline
+#   python -m python_scripts.benchmark --stages read_script match_episodes process_character_names
+import os
+import sys
+import re
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import pandas as pd
+import sqlalchemy as alch
+from python_scripts import downloading_and_cleaning_func as d_c
+from python_scripts import parquet_io, sql_loader
+from python_scripts.instrumentation import reset_peak_rss, peak_rss_bytes
+
+TRANSCRIPT_PATH = "data/Friends_Transcript.txt"
+RESULTS_PATH = "data/benchmarks/latest.json"
+BASELINE_PATH = "data/benchmarks/baseline.json"
+
+# Number of lines spoken in the original transcript, used to size the synthetic transcript
+FRIENDS_LINES = 67507
+
+# Characters and catchphrases used to build the synthetic transcript, including some of the name variants handled by process_character_names.
+# Most synthetic lines are random sentences built from the words of the catchphrases and of the scene descriptions in data/scenes.csv, so that
+# like in the real transcript most lines are distinct and the sentiment analysis (which scores every distinct line once) does real work.
+SYNTHETIC_CHARACTERS = ["Monica", "Ross", "Rachel", "Joey", "Chandler", "Phoebe", "Gunther", "Janice", "Mike", "Carol",
+                        "Ross (angry)", "Joey ", "MNCA", "CHANDLER", "RACH", "Phoebe (to Ross)"]
+SYNTHETIC_LINES = ["Hi!", "What?", "Oh my God!", "Yeah.", "Okay.", "No.", "How you doin'?", "Could this BE any more awkward?",
+                   "I love this place, it's so great to see you guys!", "This is terrible, I hate everything about this.",
+                   "We were on a break!", "Pivot! Pivot! Pivot!", "Smelly cat, smelly cat, what are they feeding you?",
+                   "I'm fine. Totally fine.", "Joey doesn't share food!", "Well, that's not what I meant at all, but okay."]
+
+# Share of the synthetic lines that are catchphrases, and number of words of the other lines
+CATCHPHRASE_SHARE = 0.2
+SENTENCE_WORDS = (3, 16)
+
+## Function declaration
+
+def generate_transcript(path, seed=0):
+    """
+    Writes a synthetic transcript with the structure of the Friends transcript: an episode title line for every episode in data/seasons.csv,
+    a scene header for every scene of that episode in data/scenes.csv and around FRIENDS_LINES lines of dialogue in total.
+    Most lines are random sentences of the vocabulary of the catchphrases and scene descriptions, the rest are catchphrases repeated many times.
+    """
+    rng = random.Random(seed)
+    seasons = pd.read_csv("data/seasons.csv", sep="~", dtype=str)
+    scenes = pd.read_csv("data/scenes.csv", sep="~", dtype=str)
+    titles = dict(zip(seasons["ep_number_overall"], seasons["ep_title"]))
+    lines_per_scene = max(1, FRIENDS_LINES // len(scenes))
+    vocabulary = sorted({word for text in SYNTHETIC_LINES + scenes["scene"].dropna().tolist() for word in re.findall(r"[a-z]+(?:'[a-z]+)?", text.lower())})
+    punctuation = [".", "!", "?", "...", "!!"]
+
+    def synthetic_line():
+        if rng.random() < CATCHPHRASE_SHARE:
+            return rng.choice(SYNTHETIC_LINES)
+        words = rng.choices(vocabulary, k=rng.randint(*SENTENCE_WORDS))
+        return " ".join(words).capitalize() + rng.choice(punctuation)
+
+    with open(path, "w") as f:
+        for episode, episode_scenes in scenes.groupby("episode", sort=False):
+            f.write(f"{str(titles.get(episode, episode)).upper()} (Synthetic)\n\n")
+            for scene in episode_scenes["scene"]:
+                f.write(f"[Scene: {scene}.]\n")
+                for _ in range(lines_per_scene):
+                    f.write(f"{rng.choice(SYNTHETIC_CHARACTERS)}: {synthetic_line()}\n")
+                f.write("(They all exit.)\n\n")
+
+def scale_transcript(source, path, scale):
+    """
+    Writes the transcript in 'source' repeated 'scale' times to 'path', simulating a corpus 'scale' times larger.
+    Every line of dialogue of a copy after the first one ends with a word of its own ("take2", "take3"...), so that every copy adds new distinct lines
+    and the cost of the sentiment analysis grows with the scale instead of being served by the deduplication.
+    """
+    with open(source, "r") as f:
+        lines = f.read().splitlines()
+    with open(path, "w") as f:
+        for copy in range(scale):
+            for line in lines:
+                _, _, character, dialogue = d_c.process_line(line)
+                if copy > 0 and character != "none" and dialogue:
+                    line = f"{line} take{copy + 1}"
+                f.write(line + "\n")
+
+def measure(stage, scale, rows, function, *args, **kwargs):
+    """
+    Runs function(*args, **kwargs) and returns its result together with a dictionary with the wall time, peak RSS and rows/sec of the run.
+    If the function fails the error is recorded and the result is None.
+    """
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        result, error = function(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+
+    record = {
+        "stage": stage,
+        "scale": scale,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(peak, 1) if (peak := peak_rss_bytes()) is not None else None,
+        "error": error,
+    }
+    status = f"ERROR {error}" if error else f"{record['seconds']:.3f}s, {record['rows_per_sec']} rows/s, {record['peak_rss_mb']} MB"
+    print(f"  {stage:<28} x{scale:<4} {rows:>9} rows  {status}")
+    return result, record
+
+def run_scale(source, scale, stages, n_workers=None):
+    """
+    Runs every stage of the pipeline on the transcript in 'source' scaled 'scale' times. Must be called from a working directory with a data/ folder,
+    since the export functions write to data/.
+
+    Returns:
+    list of dict: one record per stage, as returned by measure.
+    """
+    records = []
+
+    def run(stage, rows, function, *args, **kwargs):
+        if stage not in stages:
+            return None
+        result, record = measure(stage, scale, rows, function, *args, **kwargs)
+        records.append(record)
+        return result
+
+    path = f"data/transcript_x{scale}.txt"
+    scale_transcript(source, path, scale)
+    with open(path, "r") as f:
+        raw_lines = f.readlines()
+    raw_rows = len(raw_lines)
+
+    # Parsing and cleaning, the legacy in-memory path and the streaming parser
+    raw_script = run("process_script", raw_rows, d_c.process_script, raw_lines)
+    if raw_script is not None:
+        run("clean_friends_script", len(raw_script), d_c.clean_friends_script, raw_script)
+    del raw_lines, raw_script
+
+    # The rest of the stages need the output of the previous ones, so they are always computed even if they are not measured
+    friends_script = run("read_script", raw_rows, d_c.read_script, path)
+    if friends_script is None:
+        friends_script = d_c.read_script(path)
+    rows = len(friends_script)
+
+    f_scene_info = run("create_scene_info", rows, d_c.create_scene_info, friends_script)
+    if f_scene_info is None:
+        f_scene_info = d_c.create_scene_info(friends_script)
+
+    f_seasons = d_c.get_seasons(offline=True, cache_dir="data/cache")
+    matched = run("match_episodes", len(f_scene_info), d_c.match_episodes, f_scene_info.copy(), f_seasons)
+    f_scene_info, f_seasons = matched if matched is not None else d_c.match_episodes(f_scene_info.copy(), f_seasons)
+
+    script = run("match_episode_numbers", rows, d_c.match_episode_numbers_in_script, friends_script, f_scene_info)
+    if script is None:
+        script = d_c.match_episode_numbers_in_script(friends_script, f_scene_info)
+    del friends_script
+    rows = len(script)
+
+    named = run("process_character_names", rows, d_c.process_character_names, script.copy())
+    script = named if named is not None else d_c.process_character_names(script)
+
+    scored = run("sentiment_analysis", rows, d_c.sentiment_analysis, script.copy(), n_workers=n_workers, cache_path=None)
+    if scored is None:
+        # Stages after this one only need the sentiment columns to exist
+        scored = script.assign(**{column: 0.0 for column in d_c.SIA_COLUMNS + d_c.TB_COLUMNS})
+    script, f_seasons = d_c.rename_columns_for_sql(scored, f_seasons)
+    del scored
+
+    # Exports
+    run("export_friends_info_csv", rows, d_c.export_friends_info_csv, script, f_seasons, f_scene_info)
+    run("export_friends_info_parquet", rows, parquet_io.export_friends_info_parquet, script, f_seasons, f_scene_info, "data/")
+    if "read_friends_info_parquet" in stages and os.path.exists("data/script.parquet"):
+        run("read_friends_info_parquet", rows, parquet_io.read_friends_info_parquet, "data/")
+
+    # Uploads to a local SQLite database, with DataFrame.to_sql as it was done before and with the bulk loader
+    engine = alch.create_engine(f"sqlite:///data/benchmark_x{scale}.sqlite")
+
+    def to_sql_upload():
+        script.to_sql("script", con=engine, if_exists="replace")
+        f_scene_info.to_sql("scenes", con=engine, if_exists="replace")
+        f_seasons.to_sql("seasons", con=engine, if_exists="replace")
+
+    run("to_sql_upload", rows, to_sql_upload)
+    run("bulk_upload", rows, sql_loader.upload_friends_info, engine, script, f_scene_info, f_seasons)
+    engine.dispose()
+
+    os.remove(path)
+    return records
+
+# Every stage that can be benchmarked, in the order they run
+STAGE_NAMES = ["process_script", "clean_friends_script", "read_script", "create_scene_info", "match_episodes", "match_episode_numbers",
+               "process_character_names", "sentiment_analysis", "export_friends_info_csv", "export_friends_info_parquet",
+               "read_friends_info_parquet", "to_sql_upload", "bulk_upload"]
+
+def compare_with_baseline(records, baseline, tolerance=0.2):
+    """
+    Compares the results with a baseline and returns the list of regressions: stages that fail but did not fail in the baseline,
+    and stages whose wall time or peak RSS grew more than 'tolerance' (as a fraction) compared to the baseline for the same scale.
+    """
+    baseline_records = {(record["stage"], record["scale"]): record for record in baseline["results"]}
+    regressions = []
+    for record in records:
+        old = baseline_records.get((record["stage"], record["scale"]))
+        if old is None:
+            continue
+        if record["error"] and not old["error"]:
+            regressions.append(f"{record['stage']} x{record['scale']}: {record['error']}")
+        if record["error"] or old["error"]:
+            continue
+        for metric in ["seconds", "peak_rss_mb"]:
+            if old[metric] and record[metric] is not None and record[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{record['stage']} x{record['scale']}: {metric} {old[metric]} -> {record[metric]}")
+    return regressions
+
+def main(argv=None):
+    """
+    Command line interface of the benchmark suite. Returns the exit code: 1 if any stage failed or any regression was found compared with the baseline.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the Friends pipeline on scaled transcripts.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="how many times the transcript is repeated")
+    parser.add_argument("--stages", nargs="+", choices=STAGE_NAMES, default=STAGE_NAMES, help="stages to measure")
+    parser.add_argument("--transcript", default=TRANSCRIPT_PATH, help="transcript to use, a synthetic one is generated if it does not exist")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes for the sentiment analysis")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to save the results")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline to compare the results with")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed growth of time and memory before a regression is flagged")
+    args = parser.parse_args(argv)
+
+    repo_dir = os.getcwd()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+    transcript = os.path.abspath(args.transcript)
+
+    # Run in a temporary folder with a copy of the bundled data, so the exports do not overwrite the files in data/
+    work_dir = tempfile.mkdtemp(prefix="friends_benchmark_")
+    shutil.copytree(os.path.join(repo_dir, "data"), os.path.join(work_dir, "data"), ignore=shutil.ignore_patterns("*.txt", "*.sqlite", "checkpoints", "benchmarks"))
+    os.chdir(work_dir)
+    try:
+        source = transcript
+        if not os.path.exists(source):
+            print(f"{args.transcript} not found, generating a synthetic transcript from the bundled data")
+            source = "data/synthetic_transcript.txt"
+            generate_transcript(source)
+
+        records = []
+        for scale in args.scales:
+            print(f"Scale x{scale}:")
+            records += run_scale(source, scale, set(args.stages), n_workers=args.workers)
+    finally:
+        os.chdir(repo_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "transcript": args.transcript if os.path.exists(transcript) else "synthetic",
+        },
+        "results": records,
+    }
+
+    # Save the results and, if requested, the baseline
+    for path in [output] + ([baseline_path] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=1)
+    print(f"Results saved to {args.output}")
+
+    # A stage that fails is always reported, with or without a baseline
+    errors = [record for record in records if record["error"]]
+    for record in errors:
+        print(f"ERROR {record['stage']} x{record['scale']}: {record['error']}")
+
+    # Compare with the baseline
+    if args.save_baseline or not os.path.exists(baseline_path):
+        return 1 if errors else 0
+    with open(baseline_path, "r") as f:
+        regressions = compare_with_baseline(records, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions compared with the baseline")
+    return 1 if regressions or errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
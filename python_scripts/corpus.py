@@ -0,0 +1,271 @@
+# This file declares the batch mode that runs the cleaning and sentiment analysis of the Friends script over a directory with the transcripts of several shows.
+# Every sub-folder of the directory holds the .txt transcripts of one show, parsed with the parsing profile of that show: the markers of its scene headers
+# and episode titles and its main cast (see FRIENDS_PROFILE in downloading_and_cleaning_func.py). The profiles are read from a profiles.json file
+# in the directory, keyed by the name of the folder, e.g.:
+#   {"Seinfeld": {"scene_marker": "[Setting:", "scene_end": "]", "title_marker": "EPISODE", "main_cast": ["Jerry", "George", "Elaine", "Kramer"]}}
+#
+# The transcripts are processed concurrently in a pool of worker processes, largest first, and every worker writes the lines of its transcript
+# partitioned by show and season (data/corpus/show=<show>/season=<season>/<transcript>.parquet), so the output of several files is never merged in memory.
+# The season is read from the name of the file, or else from the episode titles of the transcript, matched with the episodes of the show
+# (the "seasons" CSV of its profile, with a Title and a season column, or the season data of get_seasons for Friends), so a single transcript
+# with every episode is split into one partition per season.
+# It can be run from the command line, e.g.:
+#   python -m python_scripts.corpus transcripts/ --output data/corpus --workers 8
+import os
+import re
+import json
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from python_scripts import downloading_and_cleaning_func as d_c
+from python_scripts.episode_resolver import EpisodeResolver
+from python_scripts.instrumentation import Instrumentation, LogSink
+from python_scripts.schemas import compact_frame
+
+# Name of the file with the parsing profiles, in the transcript directory
+PROFILES_FILE = "profiles.json"
+
+# Keys of a parsing profile that are not given in profiles.json. Transcripts without title lines use the name of the file as the episode,
+# and the season is read from the name of the file (e.g. "S01E05.txt" or "season_2.txt") or else from the episode titles, see seasons_of_episodes.
+# "seasons" is the path of a CSV with the Title and season of every episode of the show, and "episode_aliases" maps titles that can not be matched by
+# similarity to the row of their episode in it (its "No.overall" column if it has one).
+PROFILE_DEFAULTS = {
+    "scene_marker": "[Scene:",
+    "scene_end": "]",
+    "title_marker": None,
+    "title_end": "(",
+    "main_cast": [],
+    "character_names": {},
+    "files": "*.txt",
+    "season_pattern": r"(?:^|[^a-z])s(?:eason)?[ _-]?(\d+)",
+    "seasons": None,
+    "episode_aliases": {},
+}
+
+# Name of the partition of the lines without a season
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Types of the partition columns, read as <NA> from the default partition
+PARTITIONING = ds.partitioning(pa.schema([("show", pa.string()), ("season", pa.int32())]), flavor="hive")
+
+# Columns of the partitioned output, besides the show and season of the partition
+CORPUS_COLUMNS = ["source", "episode", "scene_number", "scene", "f_char", "f_line"] + d_c.SIA_COLUMNS + d_c.TB_COLUMNS
+
+## Function declaration
+
+def load_profiles(transcripts_dir, profiles_path=None):
+    """
+    Reads the parsing profile of every show from profiles.json and fills in the PROFILE_DEFAULTS. The Friends profile is always available.
+
+    Parameters:
+    transcripts_dir (str): Directory with a sub-folder of transcripts for every show.
+    profiles_path (str): Path of the profiles file, defaults to profiles.json in transcripts_dir.
+
+    Returns:
+    dict: The parsing profile of every show, by name of its folder.
+    """
+    profiles = {"Friends": {**PROFILE_DEFAULTS, **d_c.FRIENDS_PROFILE, "episode_aliases": d_c.EPISODE_ALIASES}}
+    profiles_path = profiles_path or os.path.join(transcripts_dir, PROFILES_FILE)
+    if os.path.exists(profiles_path):
+        with open(profiles_path, "r") as f:
+            for show, profile in json.load(f).items():
+                profiles[show] = {**PROFILE_DEFAULTS, "show": show, **profile}
+    return profiles
+
+def find_transcripts(transcripts_dir, profiles):
+    """
+    Lists the transcripts of every show with a profile, largest first so that the longest tasks start first in the pool.
+
+    Returns:
+    list of tuple: The path, show and parsing profile of every transcript.
+
+    Raises:
+    ValueError if a folder of the directory has no parsing profile.
+    """
+    transcripts = []
+    for show in sorted(os.listdir(transcripts_dir)):
+        folder = os.path.join(transcripts_dir, show)
+        if not os.path.isdir(folder):
+            continue
+        if show not in profiles:
+            raise ValueError(f"There is no parsing profile for the show '{show}', add it to {PROFILES_FILE}")
+        for path in glob.glob(os.path.join(folder, profiles[show]["files"])):
+            transcripts.append((path, show, profiles[show]))
+    return sorted(transcripts, key=lambda transcript: os.path.getsize(transcript[0]), reverse=True)
+
+def season_of(path, profile):
+    """
+    Returns the season number found in the name of a transcript with the season_pattern of its profile, or None if there is none.
+    """
+    match = re.search(profile["season_pattern"], os.path.splitext(os.path.basename(path))[0], flags=re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+def episode_seasons(profile):
+    """
+    Returns the known episodes of the show of a profile with their Title and season: the "seasons" CSV of the profile, or the cached or bundled
+    season data of Friends (get_seasons without the network, the workers never download it). Returns None if the seasons of the show are not known.
+    """
+    if profile["seasons"]:
+        return pd.read_csv(profile["seasons"], dtype=str)
+    if profile.get("show") == d_c.FRIENDS_PROFILE["show"]:
+        return d_c.split_multi_part_episodes(d_c.get_seasons(offline=True))
+    return None
+
+def seasons_of_episodes(episodes, profile):
+    """
+    Finds the season of every episode title of a transcript: the season of the known episode it matches (see episode_seasons and EpisodeResolver),
+    or else the season found in the title itself with the season_pattern of the profile.
+
+    Parameters:
+    episodes (pandas Series): The episode title of every line.
+    profile (dict): Parsing profile of the show.
+
+    Returns:
+    pandas Series: The season of every line, <NA> where it is not known.
+    """
+    titles = pd.Series(episodes.unique(), dtype=object)
+    seasons = titles.str.extract(profile["season_pattern"], flags=re.IGNORECASE)[0]
+
+    # Match the titles with the known episodes, every episode is identified by its number or by its row
+    known = episode_seasons(profile)
+    if known is not None:
+        ids = known["No.overall"].astype(str) if "No.overall" in known.columns else known.index.astype(str)
+        resolver = EpisodeResolver(known["Title"].tolist(), ids.tolist(), aliases=profile["episode_aliases"])
+        matched = resolver.resolve(titles)["episode"].map(dict(zip(ids, known["season"])))
+        seasons = matched.fillna(seasons)
+
+    seasons = pd.to_numeric(seasons, errors="coerce").astype("Int64")
+    return episodes.map(dict(zip(titles, seasons))).astype("Int64")
+
+def process_transcript(path, show, profile, output_dir, cache_path=None):
+    """
+    Parses, names and scores the lines of a single transcript and writes them to the partitions of its show and seasons.
+    This function runs inside the worker processes: the lines are scored in the worker itself (n_workers=1), the pool already uses every core.
+
+    Parameters:
+    path (str): Path of the transcript.
+    show (str): Name of the show.
+    profile (dict): Parsing profile of the show.
+    output_dir (str): Root folder of the partitioned output.
+    cache_path (str): Path of the sentiment cache shared by the workers, or None to score every line.
+
+    Returns:
+    list of dict: The show, source file, season and number of lines of every season of the transcript.
+    """
+    source = os.path.splitext(os.path.basename(path))[0]
+
+    # Parse the transcript, lines before the first title belong to an episode named after the file
+    script = d_c.read_script(path, profile=profile)
+    script["episode"] = script["episode"].fillna(source)
+
+    # The season of the file applies to all its lines, otherwise every episode can be from another season
+    season = season_of(path, profile)
+    if season is not None:
+        seasons = pd.Series(season, index=script.index, dtype="Int64")
+    elif profile["title_marker"]:
+        seasons = seasons_of_episodes(script["episode"], profile)
+    else:
+        seasons = pd.Series(pd.NA, index=script.index, dtype="Int64")
+    script = d_c.process_character_names(script, profile)
+    script = d_c.sentiment_analysis(script, n_workers=1, cache_path=cache_path)
+
+    script = script.rename(columns={"character": "f_char", "line": "f_line"})
+    script["source"] = source
+    script = compact_frame(script[CORPUS_COLUMNS])
+
+    # Remove the output of a previous run, its lines could be in other seasons
+    for previous in glob.glob(os.path.join(glob.escape(os.path.join(output_dir, f"show={show}")), "season=*", glob.escape(f"{source}.parquet"))):
+        os.remove(previous)
+
+    # Write the lines of every season of the transcript to the partition of the season
+    summaries = []
+    for season, lines in script.groupby(seasons.fillna(-1).to_numpy(), sort=True):
+        season = None if season == -1 else int(season)
+        partition = os.path.join(output_dir, f"show={show}", f"season={season if season is not None else DEFAULT_PARTITION}")
+        os.makedirs(partition, exist_ok=True)
+        lines.to_parquet(os.path.join(partition, f"{source}.parquet"), index=False)
+        summaries.append({"show": show, "source": source, "season": season, "rows": len(lines)})
+    return summaries
+
+def run_batch(transcripts_dir, output_dir="data/corpus", profiles_path=None, n_workers=None, cache_path="data/sentiment_cache.sqlite", instrumentation=None):
+    """
+    Processes every transcript of the directory concurrently in a pool of worker processes, see process_transcript.
+
+    Parameters:
+    ----------
+    transcripts_dir : str
+        Directory with a sub-folder of transcripts for every show.
+    output_dir : str
+        Root folder of the output partitioned by show and season.
+    profiles_path : str, optional
+        Path of the parsing profiles, defaults to profiles.json in transcripts_dir.
+    n_workers : int, optional
+        Number of worker processes. Defaults to the number of CPUs of the machine.
+    cache_path : str, optional
+        Path of the sentiment cache, or None to score every line without a cache.
+    instrumentation : Instrumentation, optional
+        Receives the duration of the batch and the progress (transcripts/sec and ETA) after every transcript.
+
+    Returns:
+    -------
+    pandas.DataFrame
+        The show, source file, season and number of lines of every season of every transcript.
+    """
+    transcripts = find_transcripts(transcripts_dir, load_profiles(transcripts_dir, profiles_path))
+    print(f"Processing {len(transcripts)} transcripts of {len({show for _, show, _ in transcripts})} shows...")
+
+    instrumentation = instrumentation or Instrumentation()
+    summaries = []
+    with instrumentation.stage("corpus", rows_in=len(transcripts)) as record:
+        instrumentation.progress("corpus", 0, len(transcripts))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(process_transcript, path, show, profile, output_dir, cache_path) for path, show, profile in transcripts]
+            for done, future in enumerate(as_completed(futures), start=1):
+                summaries.extend(future.result())
+                instrumentation.progress("corpus", done, len(transcripts))
+        record["rows_out"] = sum(summary["rows"] for summary in summaries)
+
+    print("Done!")
+    return pd.DataFrame(summaries, columns=["show", "source", "season", "rows"]).astype({"season": "Int64"}).sort_values(["show", "season", "source"], ignore_index=True)
+
+def read_corpus(output_dir="data/corpus", shows=None, seasons=None):
+    """
+    Reads the partitioned output of run_batch, only reading the partitions of the given shows and seasons.
+
+    Returns:
+    pandas.DataFrame: The lines with their show and season columns.
+    """
+    filters = []
+    if shows is not None:
+        filters.append(("show", "in", list(shows)))
+    if seasons is not None:
+        filters.append(("season", "in", list(seasons)))
+    return pd.read_parquet(output_dir, partitioning=PARTITIONING, filters=filters or None)
+
+def main(argv=None):
+    """
+    Command line interface of the batch mode.
+    """
+    parser = argparse.ArgumentParser(description="Clean and score the transcripts of several shows in parallel.")
+    parser.add_argument("transcripts_dir", help="directory with a folder of .txt transcripts for every show")
+    parser.add_argument("--output", default="data/corpus", help="root folder of the output partitioned by show and season")
+    parser.add_argument("--profiles", help=f"path of the parsing profiles, defaults to {PROFILES_FILE} in the transcript directory")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--no-cache", action="store_true", help="score every line without the sentiment cache")
+    parser.add_argument("--log-metrics", action="store_true", help="print the progress and duration of the batch as JSON lines")
+    args = parser.parse_args(argv)
+
+    instrumentation = Instrumentation([LogSink()] if args.log_metrics else [])
+    try:
+        summary = run_batch(args.transcripts_dir, args.output, args.profiles, args.workers,
+                            cache_path=None if args.no_cache else "data/sentiment_cache.sqlite", instrumentation=instrumentation)
+    finally:
+        instrumentation.close()
+    print(summary.to_string(index=False))
+    return summary
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,20 @@
 # This file declares functions I will use to download and clean my data. This script is called by the main jupyter notebook in this repo.
+# Heavy dependencies (nltk, textblob) are imported inside the functions that use them, so importing this file is fast and has no network side effects.
 import os
-import requests
+import io
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
-import kaggle
 import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-nltk.downloader.download('vader_lexicon', quiet = True)
-from textblob import TextBlob
+from importlib.metadata import version
+from python_scripts import acquisition
+from python_scripts.sentiment_cache import SentimentCache
+from python_scripts.episode_resolver import EpisodeResolver
+from python_scripts.instrumentation import Instrumentation
+from python_scripts.vader_batch import VaderBatchScorer, SCORER_VERSION
+from python_scripts.schemas import compact_frame, validate_frame
 
 # Muting warnings
 pd.set_option('mode.chained_assignment', None)
@@ -19,15 +24,80 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 
 ## Function declaration
 
-def download_friends_script():
+# Kaggle API URL of the "Friends TV Show Script" dataset and name of the transcript inside its zip archive
+TRANSCRIPT_URL = "https://www.kaggle.com/api/v1/datasets/download/divyansh22/friends-tv-show-script"
+TRANSCRIPT_FILE = "Friends_Transcript.txt"
+
+# Sources of the season metadata: the Wikipedia page, the local cache of the page and of the parsed table, and the snapshot bundled with the repo.
+SEASONS_URL = "https://en.wikipedia.org/wiki/List_of_Friends_episodes"
+SEASONS_CACHE_DIR = "data/cache"
+SEASONS_SNAPSHOT = "data/seasons.csv"
+SEASONS_HTML = "List_of_Friends_episodes.html"
+# Wikipedia refuses requests without a descriptive User-Agent
+WIKIPEDIA_HEADERS = {"User-Agent": "Friends-TV-Show-Sentiment-Analysis/1.0 (data download script)"}
+
+def download_friends_script(url=TRANSCRIPT_URL, data_dir="data/", cache_dir=SEASONS_CACHE_DIR, seasons_url=SEASONS_URL):
     """
-    This function downloads the Friends tv show script from the "Friends TV Show Script" from Kaggle using the Kaggle API.
+    This function downloads the Friends tv show script from the "Friends TV Show Script" from Kaggle using the Kaggle API,
+    and at the same time the Wikipedia page with the list of episodes used by get_seasons.
+    Both files are downloaded concurrently and only if they changed since the last download (see acquisition.py), and an interrupted download is resumed.
+    The transcript is extracted from the downloaded zip archive when the archive changed or the transcript is missing. A corrupt archive is deleted,
+    so that it is downloaded again on the next run, and the local copy of the transcript is used instead.
+
+    Parameters:
+    url (str): URL of the zip archive with the transcript, any URL supported by urllib (e.g. file://).
+    data_dir (str): Folder where the transcript is extracted.
+    cache_dir (str): Folder where the downloaded files and their manifest are kept.
+    seasons_url (str): URL of the Wikipedia page, or None to only download the transcript.
+
+    Raises:
+    OSError if the transcript can not be downloaded and there is no local copy.
+    zipfile.BadZipFile if the downloaded archive is corrupt and there is no local copy.
     """
-    os.system('kaggle datasets download -d divyansh22/friends-tv-show-script --unzip --p "data/"')
-    
-    return "Done! Downloaded to data/"
+    zip_path = os.path.join(cache_dir, "friends-tv-show-script.zip")
+    transcript_path = os.path.join(data_dir, TRANSCRIPT_FILE)
+
+    # The Wikipedia page is optional, get_seasons falls back to the cached or bundled season data
+    sources = [{"url": url, "path": zip_path, "headers": acquisition.kaggle_headers()}]
+    if seasons_url:
+        sources.append({"url": seasons_url, "path": os.path.join(cache_dir, SEASONS_HTML), "headers": WIKIPEDIA_HEADERS, "required": False})
+
+    try:
+        changed = acquisition.acquire(sources, os.path.join(cache_dir, "downloads.json"))
+    except OSError as e:
+        if not os.path.exists(transcript_path):
+            raise
+        print(f"Could not download the script ({e}), using the local copy")
+        return f"Using the local copy in {data_dir}"
+
+    if changed[zip_path] or not os.path.exists(transcript_path):
+        os.makedirs(data_dir, exist_ok=True)
+        try:
+            acquisition.extract_zip_member(zip_path, TRANSCRIPT_FILE, transcript_path)
+        except zipfile.BadZipFile as e:
+            # The manifest matches the corrupt file, without it the next run downloads the archive again
+            os.remove(zip_path)
+            if not os.path.exists(transcript_path):
+                raise
+            print(f"Could not extract the script ({e}), using the local copy")
+            return f"Using the local copy in {data_dir}"
+        return f"Done! Downloaded to {data_dir}"
+    return f"Already up to date in {data_dir}"
+
+# Parsing profile of the Friends transcript: the markers of the scene headers and episode titles, the main cast and the all-uppercase and abbreviated names of the main cast.
+# Full names come before their abbreviations so that they are matched first. The batch mode in corpus.py uses profiles with the same keys for other shows.
+FRIENDS_PROFILE = {
+    "show": "Friends",
+    "scene_marker": "[Scene:",
+    "scene_end": ".]",
+    "title_marker": "THE ONE",
+    "title_end": "(",
+    "main_cast": ["Ross", "Rachel", "Monica", "Joey", "Chandler", "Phoebe"],
+    "character_names": {"MONICA": "Monica", "CHANDLER": "Chandler", "JOEY": "Joey", "PHOEBE": "Phoebe", "RACHELL": "Rachel", "ROSS": "Ross",
+                        "MNCA": "Monica", "CHAN": "Chandler", "PHOE": "Phoebe", "RACH": "Rachel"},
+}
 
-def process_line(line):
+def process_line(line, profile=FRIENDS_PROFILE):
     """The function process_line takes a line of text from the Friends script and extracts relevant information from it.
         It returns a tuple with four elements representing episode, scene, character, and dialogue, respectively.
         If the line contains scene information, it extracts the scene description and returns it along with empty strings for the other elements.
@@ -35,17 +105,25 @@ def process_line(line):
         If the line contains character information, it extracts the character name and dialogue and returns them along with empty strings for the other elements.
         If the line contains neither scene, title, nor character information, it returns an empty string for the episode and character elements and the line itself for the dialogue element.
         
+        The scene and title markers are read from the parsing profile of the show, FRIENDS_PROFILE by default. A profile without "title_marker" has no title lines.
+        The "scene_end" of the profile (".]" for Friends) is removed from the end of the scene headers, or only the closing bracket if a header does not end with it.
+
         This function will be used to read the script and turn it into a DF.
         """
     # Remove newline character
     line = line.strip()
     # Check if line contains scene information
-    if line.startswith("[Scene:"):
-        scene = line[8:-2]
-        return ("", scene, "none", "")
+    if line.startswith(profile["scene_marker"]):
+        scene = line[len(profile["scene_marker"]):]
+        scene_end = profile.get("scene_end", "]")
+        if scene.endswith(scene_end):
+            scene = scene[:-len(scene_end)]
+        elif scene.endswith("]"):
+            scene = scene[:-1]
+        return ("", scene.strip(), "none", "")
     # Check if line contains title information
-    elif line.startswith("THE ONE"):
-        episode = line.split("(")[0].strip()
+    elif profile.get("title_marker") and line.startswith(profile["title_marker"]):
+        episode = line.split(profile.get("title_end", "("))[0].strip()
         return (episode, "", "none", "")
     # Check if line contains character information
     elif line.strip() and line[0].isupper() and ":" in line:
@@ -64,13 +142,20 @@ def process_script(script):
     script: A list of strings where each line represents a line of dialogue from the script.
     
     Returns:
-    A pandas DataFrame with columns for episode, scene, character, and line, where each row 
+    A pandas DataFrame with columns for episode, scene, scene_number, character, and line, where each row 
     represents a line of dialogue from the script with the corresponding extracted information.
+    The scene_number is increased every time a scene header or an episode title is found and is missing before the first of them,
+    so the lines between a title and the first scene header of the episode (cold opens) never share a scene number with the previous episode.
     """
     lines = []
     for line in script:
         lines.append(process_line(line))
-    return pd.DataFrame(lines, columns=["episode", "scene", "character", "line"])
+    friends_script = pd.DataFrame(lines, columns=["episode", "scene", "character", "line"])
+
+    # Number the scenes in the order their headers appear in the script, every episode title also starts a new scene
+    scene_count = ((friends_script["scene"] != "") | (friends_script["episode"] != "")).cumsum()
+    friends_script.insert(2, "scene_number", (scene_count - 1).where(scene_count > 0).astype("Int64"))
+    return friends_script
 
 def clean_friends_script(friends_script):
     """
@@ -87,14 +172,78 @@ def clean_friends_script(friends_script):
     friends_script.replace("", pd.NA, inplace=True)
 
     # Fill forward missing values in columns "episode" and "scene" so that we can process these in the future in SQL.
-    friends_script["episode"].fillna(method="ffill", inplace=True)
-    friends_script["scene"].fillna(method="ffill", inplace=True)
+    friends_script["episode"] = friends_script["episode"].ffill()
+    friends_script["scene"] = friends_script["scene"].ffill()
 
     # Drop rows where "character" column has value "none" and "line" column is NaN, these lines are just titles of the episodes and we already have this information in the rest of the cells of the "episode" column.
     friends_script = friends_script.loc[(friends_script['character'] != 'none') & (friends_script['line'].notna())]
     
     return friends_script
 
+def stream_script(path, chunk_size=10000, profile=FRIENDS_PROFILE):
+    """
+    Reads the Friends script .txt file lazily and yields the cleaned script in chunks of pandas DataFrames.
+    This is a single pass equivalent of process_script followed by clean_friends_script: every line is parsed with process_line while the current episode and scene are carried along,
+    so the rows yielded are already forward filled and only contain the lines spoken by a character. Only one chunk is held in memory at a time.
+    Every scene header or episode title found increases the scene_number, an integer key that identifies the scene of every line, the same way as in process_script.
+
+    Args:
+    path: Path of the .txt file with the script.
+    chunk_size: Maximum number of rows in every chunk.
+    profile: Parsing profile of the show, see process_line.
+
+    Yields:
+    A pandas DataFrame with columns for episode, scene, scene_number, character, and line for every chunk of at most chunk_size rows.
+    """
+    columns = ["episode", "scene", "scene_number", "character", "line"]
+    episode = pd.NA
+    scene = pd.NA
+    scene_number = pd.NA
+    rows = []
+
+    with open(path, "r") as f:
+        for raw_line in f:
+            new_episode, new_scene, character, line = process_line(raw_line, profile)
+
+            # Keep track of the current episode and scene, this replaces the forward fill of clean_friends_script
+            if new_episode:
+                episode = new_episode
+                # The lines before the first scene header of the episode belong to the new episode
+                scene_number = 0 if scene_number is pd.NA else scene_number + 1
+            if new_scene:
+                scene = new_scene
+                scene_number = 0 if scene_number is pd.NA else scene_number + 1
+
+            # Only keep the lines spoken by a character, the same filter used in clean_friends_script
+            if character != "none" and line:
+                rows.append((episode, scene, scene_number, character or pd.NA, line))
+
+            # Yield a chunk as soon as it is full
+            if len(rows) == chunk_size:
+                yield pd.DataFrame(rows, columns=columns).astype({"scene_number": "Int64"})
+                rows = []
+
+    # Yield the last chunk
+    if rows:
+        yield pd.DataFrame(rows, columns=columns).astype({"scene_number": "Int64"})
+
+def read_script(path, chunk_size=10000, profile=FRIENDS_PROFILE):
+    """
+    Reads and cleans the Friends script .txt file using stream_script and returns it as a single pandas DataFrame.
+
+    Args:
+    path: Path of the .txt file with the script.
+    chunk_size: Number of rows parsed at a time.
+    profile: Parsing profile of the show, see process_line.
+
+    Returns:
+    A pandas DataFrame with the same columns and rows as the output of clean_friends_script.
+    """
+    chunks = list(stream_script(path, chunk_size, profile))
+    if not chunks:
+        return pd.DataFrame(columns=["episode", "scene", "scene_number", "character", "line"]).astype({"scene_number": "Int64"})
+    return pd.concat(chunks, ignore_index=True)
+
 def create_scene_info(friends_script):
     """
     This function takes a cleaned Friends script and returns a new DataFrame with information on the scenes per episode.
@@ -106,26 +255,18 @@ def create_scene_info(friends_script):
     f_scene_info (DataFrame): a DataFrame containing the episode title, scene number, and scene name for each scene in each episode.
     """
 
-    # Select only the episode and scene columns from the script
-    f_scene_info =friends_script[["episode","scene"]]
-
-    # Remove any duplicate rows
-    f_scene_info.drop_duplicates(inplace=True)
+    # Select only the scene number, episode and scene columns from the script
+    f_scene_info = friends_script[["scene_number","episode","scene"]]
 
     # Remove any rows with missing values
-    f_scene_info.dropna(inplace=True)
+    f_scene_info = f_scene_info.dropna()
 
-    # Reset the index of the DataFrame
-    f_scene_info.reset_index(inplace=True)
+    # Keep a single row for every scene, the scene number was assigned by the parser when it found the scene header
+    f_scene_info = f_scene_info.drop_duplicates(subset="scene_number")
 
-    # Remove the old index column from the DataFrame
-    f_scene_info.drop("index", axis =1, inplace=True)
-
-    # Reset the index of the DataFrame to use scene numbers instead of row numbers
-    f_scene_info.reset_index(inplace=True)
-
-    # Rename the new index column to "scene_number"
-    f_scene_info.rename(columns={"index":"scene_number"}, inplace=True)
+    # Reset the index of the DataFrame
+    f_scene_info = f_scene_info.reset_index(drop=True)
+    f_scene_info["scene_number"] = f_scene_info["scene_number"].astype(int)
 
     # Convert the episode titles to title case (capitalizing the first letter of each word)
     f_scene_info["episode"] = f_scene_info["episode"].str.title()
@@ -133,20 +274,48 @@ def create_scene_info(friends_script):
     # Return the new DataFrame with scene information
     return f_scene_info
 
-def get_seasons():
+# Names of the columns of the seasons table as read from Wikipedia and as exported for SQL.
+SEASON_SQL_COLUMNS = {'No.overall' : 'ep_number_overall', 'No. inseason':'ep_number_season', 'Title':'ep_title','Directed by' : "directed_by", "Written by":"written_by", "Original air date":"org_air_date", "Prod.code": "prod_code", "U.S. viewers(millions)" :"us_viewers_mm", "Rating(18–49)":"rating_1", "Rating/share(18–49)" : "rating_2", "Special No." : "special_num" , "U.S. viewersmillions" : "us_viewers_mm_2"}
+
+def is_fresh(path, max_age_days):
     """
-    This function retrieves information about the seasons of the Friends TV show from a Wikipedia page, 
-    and preprocesses the data to be used for analysis.
+    Returns True if the file at path exists and was modified less than max_age_days ago.
+    """
+    return os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age_days * 24 * 3600
 
-    Returns:
-    f_seasons (pandas DataFrame): A dataframe containing information about the seasons of the Friends TV show.
+def fetch_seasons_html(max_age_days=30, cache_dir=SEASONS_CACHE_DIR):
+    """
+    Returns the HTML of the Wikipedia page with the list of Friends episodes.
+    The page is stored in cache_dir and is only checked again when the cached copy is older than max_age_days, with a conditional request
+    that only downloads it again if it changed (see acquisition.py).
+
+    Raises:
+    OSError (urllib.error.URLError) if the page has to be downloaded and the network is not available.
     """
+    html_path = os.path.join(cache_dir, SEASONS_HTML)
+
+    # Use the cached page if it is fresh enough
+    if is_fresh(html_path, max_age_days):
+        with open(html_path, "r", encoding="utf-8") as f:
+            return f.read()
 
-    # URL of the Wikipedia page with the information about Friends seasons
-    seasons_url="https://en.wikipedia.org/wiki/List_of_Friends_episodes"
+    # Download the page if it changed and store it in the cache
+    acquisition.acquire([{"url": SEASONS_URL, "path": html_path, "headers": WIKIPEDIA_HEADERS}], os.path.join(cache_dir, "downloads.json"))
+    with open(html_path, "r", encoding="utf-8") as f:
+        return f.read()
 
-    # Retrieve the HTML tables from the Wikipedia page
-    seasons_list = pd.read_html(seasons_url)
+def parse_seasons_html(html):
+    """
+    Parses the HTML of the Wikipedia page with the list of Friends episodes and preprocesses the data to be used for analysis.
+
+    Parameters:
+    html (str): HTML of the Wikipedia page.
+
+    Returns:
+    f_seasons (pandas DataFrame): A dataframe containing information about the seasons of the Friends TV show.
+    """
+    # Retrieve the HTML tables from the page
+    seasons_list = pd.read_html(io.StringIO(html))
 
     # Select only the tables with season information
     f_seasons = []
@@ -165,8 +334,11 @@ def get_seasons():
     f_seasons["No. inseason"] = f_seasons["No. inseason"].fillna(-1)
     f_seasons["No. inseason"] = f_seasons["No. inseason"].astype(int)
 
-    # Remove text in square brackets from each cell of the dataframe (these are actions taken by the characters or descriptions of the scene that do not contribute to our analysis)
-    f_seasons = f_seasons.applymap(lambda x: x if pd.isnull(x) else re.sub(r'\[.*?\]', '', str(x)))
+    # Remove text in square brackets from every column of the dataframe (these are actions taken by the characters or descriptions of the scene that do not contribute to our analysis)
+    # Every non missing value is turned into a string, missing values are kept as they are.
+    for column in f_seasons.columns:
+        not_null = f_seasons[column].notna()
+        f_seasons[column] = f_seasons[column].astype(str).str.replace(r'\[.*?\]', '', regex=True).where(not_null).astype(object)
 
     # Remove double quotes from the Title column and capitalize each word to be matched with our existing episode names from the scripts
     f_seasons['Title'] = f_seasons['Title'].str.replace('"', '')
@@ -178,168 +350,252 @@ def get_seasons():
     # Return the processed dataframe
     return f_seasons
 
-def match_episodes(f_scene_info, f_seasons):
+def load_seasons_snapshot(path=SEASONS_SNAPSHOT):
+    """
+    Loads the season information from the seasons CSV bundled with the repo, exported by export_friends_info_csv, and returns it in the same format as parse_seasons_html.
+    The exported table was already modified by match_episodes, which appends two rows for every episode that has two parts and drops the original row of that episode.
+    Those changes are undone here: every pair of appended rows is merged back into a single row at the index where the original row was dropped.
+
+    Parameters:
+    path (str): Path of the exported seasons CSV.
+
+    Returns:
+    f_seasons (pandas DataFrame): A dataframe containing information about the seasons of the Friends TV show.
+    """
+    # Read every value as a string, like the values of the table parsed from Wikipedia, and restore the original column names
+    snapshot = pd.read_csv(path, sep='~', index_col=0, dtype=str)
+    snapshot = snapshot.rename(columns={sql_name: name for name, sql_name in SEASON_SQL_COLUMNS.items()})
+    snapshot.index = snapshot.index.astype(int)
+
+    # Find the index of the rows that were dropped and separate the rows that were appended
+    dropped = sorted(set(range(snapshot.index.max() + 1)) - set(snapshot.index))
+    appended = snapshot.iloc[len(snapshot) - 2 * len(dropped):]
+    f_seasons = snapshot.iloc[:len(snapshot) - 2 * len(dropped)]
+
+    # Merge every pair of appended rows into one row, sorting the pairs by episode number so that they match the order of the dropped rows
+    pairs = [appended.iloc[i:i + 2] for i in range(0, len(appended), 2)]
+    pairs.sort(key=lambda pair: int(pair['No.overall'].iloc[0]))
+    restored = []
+    for index, pair in zip(dropped, pairs):
+        row = pair.iloc[0].copy()
+        row['No.overall'] = pair['No.overall'].str.cat()
+        row['No. inseason'] = pair['No. inseason'].str.cat()
+        row.name = index
+        restored.append(row)
+
+    f_seasons = pd.concat([f_seasons, pd.DataFrame(restored)]).sort_index()
+    return f_seasons
+
+def get_seasons(max_age_days=30, offline=False, cache_dir=SEASONS_CACHE_DIR, snapshot_path=SEASONS_SNAPSHOT):
+    """
+    This function retrieves information about the seasons of the Friends TV show, 
+    and preprocesses the data to be used for analysis.
+    The data is read from the first available of these sources:
+    1. The parsed table cached in cache_dir, if it is newer than max_age_days.
+    2. The Wikipedia page (or its cached HTML), unless offline is True. The parsed table is then cached.
+    3. The parsed table cached in cache_dir, even if it is older than max_age_days.
+    4. The snapshot bundled with the repo at snapshot_path.
+
+    Parameters:
+    max_age_days (int): Number of days after which the cached data is refreshed from Wikipedia.
+    offline (bool): If True the network is never used.
+    cache_dir (str): Folder where the HTML page and the parsed table are cached.
+    snapshot_path (str): Path of the bundled seasons CSV.
+
+    Returns:
+    f_seasons (pandas DataFrame): A dataframe containing information about the seasons of the Friends TV show.
+    """
+    table_path = os.path.join(cache_dir, "seasons_wikipedia.csv")
+
+    # Use the cached table if it is fresh enough
+    if is_fresh(table_path, max_age_days):
+        return pd.read_csv(table_path, sep='~', index_col=0, dtype=str)
+
+    # Fetch and parse the Wikipedia page and cache the result
+    if not offline:
+        try:
+            f_seasons = parse_seasons_html(fetch_seasons_html(max_age_days, cache_dir))
+            os.makedirs(cache_dir, exist_ok=True)
+            f_seasons.to_csv(table_path, sep='~')
+            return f_seasons
+        except OSError as e:
+            print(f"Could not fetch season data ({e}), using local data instead")
+
+    # Use the stale cached table or the bundled snapshot
+    if os.path.exists(table_path):
+        return pd.read_csv(table_path, sep='~', index_col=0, dtype=str)
+    return load_seasons_snapshot(snapshot_path)
+
+# Episodes with two parts appear as a single row in the Wikipedia tables, with both episode numbers joined in "No.overall". match_episodes replaces each of them with one row per part.
+MULTI_PART_EPISODES = {
+    '9697': [
+        {'No.overall': '96', 'No. inseason': '23', 'Title': "The One With Ross'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Michael BorkowStory by\u200a: Jill Condon & Amy ToominTeleplay by\u200a: Shana Goldberg-Meehan & Scott Silveri', 'Original air date': 'May\xa07,\xa01998', 'Prod.code': '466623', 'U.S. viewers(millions)': '31.61','season': '4', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '16.7/49', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
+        {'No.overall': '97', 'No. inseason': '24', 'Title': "The One With Ross'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Michael BorkowStory by\u200a: Jill Condon & Amy ToominTeleplay by\u200a: Shana Goldberg-Meehan & Scott Silveri', 'Original air date': 'May\xa07,\xa01998', 'Prod.code': '466624', 'U.S. viewers(millions)': '31.61','season': '4', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '16.7/49', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan}],
+    '1617': [
+        {'No.overall': '16', 'No. inseason': '16', 'Title': 'The One With Two Parts', 'Directed by': 'Michael Lembeck', 'Written by': 'Marta Kauffman & David Crane', 'Original air date': 'February\xa023,\xa01995', 'Prod.code': '456665', 'U.S. viewers(millions)': '26.130.5', 'season': '1', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': np.nan, 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
+        {'No.overall': '17', 'No. inseason': '17', 'Title': 'The One With Two Parts', 'Directed by': 'Michael Lembeck', 'Written by': 'Marta Kauffman & David Crane', 'Original air date': 'February\xa023,\xa01995', 'Prod.code': '456666', 'U.S. viewers(millions)': '26.130.5', 'season': '1', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': np.nan, 'Special No.': np.nan, 'U.S. viewersmillions': np.nan}],
+    '169170': [
+        {'No.overall': '169', 'No. inseason': '23', 'Title': "The One With Monica And Chandler'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Gregory S. MalinsMarta Kauffman & David Crane', 'Original air date': 'May\xa017,\xa02001', 'Prod.code': '226422', 'U.S. viewers(millions)': '30.05', 'season': '7', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '15.7/43', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
+        {'No.overall': '170', 'No. inseason': '24', 'Title': "The One With Monica And Chandler'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Gregory S. MalinsMarta Kauffman & David Crane', 'Original air date': 'May\xa017,\xa02001', 'Prod.code': '226423', 'U.S. viewers(millions)': '30.05', 'season': '7', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '15.7/43', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan}],
+}
+
+# Episode titles used in the script that are too different from their Wikipedia title to be matched by similarity.
+EPISODE_ALIASES = {
+    "The One With The Thanksgiving Flashbacks" : '105',
+    "The One With Ross'S Wedding - Uncut Version" : '97',
+}
+
+def split_multi_part_episodes(f_seasons):
+    """
+    Replaces the rows of the episodes in MULTI_PART_EPISODES, which hold several parts in a single row, with one row for every part.
+
+    :param f_seasons: Pandas dataframe containing information about the episodes in each season.
+
+    :return: Pandas dataframe with one row for every part of the episodes with several parts.
+    """
+    new_rows = [row for combined in MULTI_PART_EPISODES for row in MULTI_PART_EPISODES[combined]]
+    f_seasons = pd.concat([f_seasons, pd.DataFrame(new_rows)], ignore_index=True)
+    f_seasons = f_seasons.loc[~f_seasons['No.overall'].isin(list(MULTI_PART_EPISODES))]
+    return f_seasons
+
+def match_episodes(f_scene_info, f_seasons, threshold=0.75):
     """
     Matches the episodes in the given 'f_scene_info' dataframe with their corresponding episodes in the 'f_seasons' 
-    dataframe, based on the common column "episode". Returns the updated 'f_scene_info' dataframe.
+    dataframe, based on the similarity of the episode titles. Returns the updated 'f_scene_info' dataframe.
+    Titles are resolved with an EpisodeResolver built once over the titles of 'f_seasons', so that misspelled titles are matched without a hand-maintained mapping.
+    Titles that are not similar enough to any episode keep their original value.
     
-    :param f_scene_info: Pandas dataframe containing information about the scenes in each episode, with the "episode" column corresponding to the episode number.
+    :param f_scene_info: Pandas dataframe containing information about the scenes in each episode, with the "episode" column corresponding to the episode title.
     
     :param f_seasons: Pandas dataframe containing information about the episodes in each season, with the "No.overall" column corresponding to the episode number.
+
+    :param threshold: Minimum similarity between 0 and 1 for a title to be matched.
     
-    :return: Pandas dataframe with the same columns as the input 'f_scene_info' dataframe, but with the "episode" column updated to match the episode numbers in 'f_seasons'.
+    :return: Pandas dataframe with the same columns as the input 'f_scene_info' dataframe, but with the "episode" column updated to match the episode numbers in 'f_seasons', and the 'f_seasons' dataframe with one row for every part of the episodes with several parts.
     """
-    # Merge the data frames based on the common column "episode"
-    merged_df = pd.merge(f_scene_info, f_seasons[['No.overall', 'Title', 'season']], left_on='episode', right_on='Title', how='left')
-    
-    # Replace the "episode" column with the "No.overall" column where it is available
-    merged_df['episode'] = merged_df['No.overall'].fillna(merged_df['episode'])
-
-    # Drop unnecessary columns
-    merged_df.drop(['No.overall', 'Title'], axis=1, inplace=True)
-
-    # Manually replace non matching episodes
-    mapping = {'The One Where Monica Gets A New Roomate' : '1' ,
-    'The One With Two Parts, Part 1' : '16' ,
-    'The One With Two Parts, Part 2' : '17' ,
-    "The One With Ross' New Girlfriend" : '25',
-    'The One Where Mr. Heckles Dies' : '27' ,
-    'The One With The Last' : '32' ,
-    "The One Where No-One'S Ready" : '50' ,
-    'The One Where Monica And Richard Are Friends' : '13' ,
-    'The One The Morning After' : '64' ,
-    "The One With A Chick. And A Duck" : '69' ,
-    "The One Where Chandler Crosses A Line" : '80' ,
-    "The One Where They'Re Gonna Party!" : '82' ,
-    "The One With Phoebes Uterus" : '84' ,
-    "The One With Rachels Crush" : '86' ,
-    "The One With Joeys Dirty Day" : '87' ,
-    "The One With Ross'S Wedding Parts I And Ii" : '96' ,
-    "The One With Ross'S Wedding - Uncut Version" : '97' ,
-    "The One Hundredth" : '100' ,
-    "The One With All The Kips" : '102' ,
-    "The One With The Thanksgiving Flashbacks" : '105' ,
-    "The One Where Everyone Finds Out" : '111' ,
-    "The One With A Cop" : '113' ,
-    "The One With Rachel'S Inadvertant Kiss" : '114' ,
-    "The One With The Ride Along" : '117' ,
-    "The One With Rosss Denial" : '124' ,
-    "The One With Joeys Porsche" : '126' ,
-    "The One The Last Night" : '127' ,
-    "The One With Rachels Sister" : '134' ,
-    "The One Where Chandler Cant Cry" : '135' ,
-    "The One With The Unagi" : '138' ,
-    "The One With Joeys Fridge" : '140' ,
-    "The One Where Ross Meets Elizabeths Dad" : '142' ,
-    "The One Where Pauls The Man" : '143' ,
-    "The One With Monicas Thunder" : '147' ,
-    "The One With Rachels Book" : '148' ,
-    "The One With Phoebes Cookies" : '149' ,
-    "The One With Rachels Assistant" : '150' ,
-    "The One With Rosss Book" : '153' ,
-    "The One Where Chandler Doesnt Like Dogs" : '154' ,
-    "The One With All The Cheesecake" : '157' ,
-    "The One Where Theyre Up All Night" : '158' ,
-    "The One Where Rosita Dies" : '159' ,
-    "The One Where They All Turn Thirty" : '160' ,
-    "The One With Joeys New Brain" : '161' ,
-    "The One With The Truth About London" : '162' ,
-    "The One With Joeys Award" : '164' ,
-    "The One With Ross And Monicas Cousin" : '165' ,
-    "The One With Rachels Big Kiss" : '166' ,
-    "The One With Chandlers Dad" : '168' ,
-    "The One With Chandler And Monicas Wedding" : '169' ,
-    'The One After "I Do"' : '171' ,
-    "The One With Monicas Boots" : '180' ,
-    "The One With Ross' Big Step Forward" : '181' ,
-    "The One In Massapequa" : '188' ,
-    "The One With Joeys Interview" : '189' ,
-}
-    merged_df['episode'] = merged_df['episode'].replace(mapping)
-    
-    # Re-match the seasons
-    
-    # Drop the "season" column as it will be replaced
-    merged_df.drop(['season'], axis=1, inplace=True)
+    # Separate the episodes with two parts into one row for every part
+    f_seasons = split_multi_part_episodes(f_seasons)
 
-    # Merge the data frames based on the common column "episode"
-    merged_df = pd.merge(merged_df, f_seasons[['No.overall', 'season']], left_on='episode', right_on='No.overall', how='left')
-    
-    # Modify seasons df to separate episodes with two parts
-    new_rows = [{'No.overall': '96', 'No. inseason': '23', 'Title': "The One With Ross'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Michael BorkowStory by\u200a: Jill Condon & Amy ToominTeleplay by\u200a: Shana Goldberg-Meehan & Scott Silveri', 'Original air date': 'May\xa07,\xa01998', 'Prod.code': '466623', 'U.S. viewers(millions)': '31.61','season': '4', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '16.7/49', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
-            {'No.overall': '97', 'No. inseason': '24', 'Title': "The One With Ross'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Michael BorkowStory by\u200a: Jill Condon & Amy ToominTeleplay by\u200a: Shana Goldberg-Meehan & Scott Silveri', 'Original air date': 'May\xa07,\xa01998', 'Prod.code': '466624', 'U.S. viewers(millions)': '31.61','season': '4', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '16.7/49', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
-            {'No.overall': '16', 'No. inseason': '16', 'Title': 'The One With Two Parts', 'Directed by': 'Michael Lembeck', 'Written by': 'Marta Kauffman & David Crane', 'Original air date': 'February\xa023,\xa01995', 'Prod.code': '456665', 'U.S. viewers(millions)': '26.130.5', 'season': '1', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': np.nan, 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
-            {'No.overall': '17', 'No. inseason': '17', 'Title': 'The One With Two Parts', 'Directed by': 'Michael Lembeck', 'Written by': 'Marta Kauffman & David Crane', 'Original air date': 'February\xa023,\xa01995', 'Prod.code': '456666', 'U.S. viewers(millions)': '26.130.5', 'season': '1', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': np.nan, 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
-            {'No.overall': '169', 'No. inseason': '23', 'Title': "The One With Monica And Chandler'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Gregory S. MalinsMarta Kauffman & David Crane', 'Original air date': 'May\xa017,\xa02001', 'Prod.code': '226422', 'U.S. viewers(millions)': '30.05', 'season': '7', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '15.7/43', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan},
-            {'No.overall': '170', 'No. inseason': '24', 'Title': "The One With Monica And Chandler'S Wedding", 'Directed by': 'Kevin S. Bright', 'Written by': 'Gregory S. MalinsMarta Kauffman & David Crane', 'Original air date': 'May\xa017,\xa02001', 'Prod.code': '226423', 'U.S. viewers(millions)': '30.05', 'season': '7', 'Rating(18–49)': np.nan, 'Rating/share(18–49)': '15.7/43', 'Special No.': np.nan, 'U.S. viewersmillions': np.nan}]
-    f_seasons = f_seasons.append(new_rows, ignore_index=True)
-    f_seasons = f_seasons.drop(index=[93,15,162])
-
-    # Drop the "season" column as it will be replaced
-    merged_df.drop(['season'], axis=1, inplace=True)
-
-    # Merge the data frames based on the common column "episode"
-    merged_df = pd.merge(merged_df, f_seasons[['No.overall', 'season']], left_on='episode', right_on='No.overall', how='left')
-    
-    # Update f_scene_info with the matched episodes and drop unnecessary columns
-    f_scene_info = merged_df.drop(["season", "No.overall_x", "No.overall_y"], axis=1)
+    # Build the title index once and resolve every scene title in a single pass
+    resolver = EpisodeResolver(f_seasons['Title'].tolist(), f_seasons['No.overall'].tolist(), aliases=EPISODE_ALIASES, threshold=threshold)
+    matches = resolver.resolve(f_scene_info['episode'])
+
+    # Replace the "episode" column with the matched episode number where it is available
+    f_scene_info['episode'] = matches['episode'].fillna(f_scene_info['episode'])
 
     # Return updated dataframes
     return f_scene_info, f_seasons
 
 def match_episode_numbers_in_script(friends_script,f_scene_info):
     """
-    Matches the episodes in the given 'friends_script' dataframe with their corresponding episodes in the 'f_scene_info' 
-    dataframe, based on the common column "scene". Returns the updated 'friends_script' dataframe.
+    Links every line in the given 'friends_script' dataframe with its scene in the 'f_scene_info' dataframe, based on the integer
+    "scene_number" assigned by the parser. Returns the updated 'friends_script' dataframe.
+    Since every line already carries its scene number, no join on the scene description is needed and the number of rows can never grow.
     
-    :param friends_script: Pandas dataframe containing the script for the Friends TV show, with the "scene" column corresponding to the scene number.
+    :param friends_script: Pandas dataframe containing the script for the Friends TV show, with the "scene_number" column identifying the scene of every line.
     
     :param f_scene_info: Pandas dataframe containing information about the scenes in each episode, with the "episode" column corresponding to the episode number.
     
-    :return: Pandas dataframe with the same columns as the input 'friends_script' dataframe, but with the "episode" column updated to match the episode numbers in 'f_scene_info'.
+    :return: Pandas dataframe with the character, line and scene_number columns, keeping only the lines whose scene is in 'f_scene_info'.
     """
-    # Drop rows with missing scene data, then titlecase episode column
-    friends_script = friends_script.dropna(subset=['scene'])
-    friends_script['episode'] = friends_script['episode'].str.title()
+    # Keep only the lines of known scenes
+    friends_script = friends_script.loc[friends_script['scene_number'].isin(f_scene_info['scene_number'])]
 
-    # Merge the data frames based on the common column "scene"
-    merged_df_scenes = pd.merge(friends_script, f_scene_info[['scene_number', 'episode','scene']], left_on='scene', right_on='scene', how='left')
-    
-    # Drop unnecessary columns
-    merged_df_scenes.drop(["episode_x", "scene", "episode_y"], axis=1, inplace=True)
-    
-    # Update friends_script with merged data
-    friends_script = merged_df_scenes
+    # Drop the episode and scene columns, this information is now in f_scene_info, and leave the scene number as the last column
+    friends_script = friends_script.drop(["episode", "scene"], axis=1)
+    friends_script = friends_script[[column for column in friends_script.columns if column != 'scene_number'] + ['scene_number']]
+    friends_script['scene_number'] = friends_script['scene_number'].astype(int)
 
-    return friends_script
+    return friends_script.reset_index(drop=True)
+
+def character_patterns(profile):
+    """
+    Compiles the patterns used to standardize the character names of a parsing profile: the names of the main cast followed by a description
+    in parentheses or by a single space, and the all-uppercase or abbreviated names of the main cast. A pattern is None if the profile has no names for it.
 
-def process_character_names(friends_script):
+    Returns:
+    Tuple: The main cast pattern, the abbreviations pattern and the dictionary of abbreviations.
+    """
+    main_cast = profile.get("main_cast") or []
+    names = profile.get("character_names") or {}
+    main_pattern = re.compile(r"^(" + "|".join(re.escape(name) for name in main_cast) + r") (?:\(.+)?$") if main_cast else None
+    names_pattern = re.compile("|".join(re.escape(name) for name in names)) if names else None
+    return main_pattern, names_pattern, names
+
+# Patterns used to standardize the character names of the Friends script, compiled once.
+MAIN_CHARACTER_PATTERN, CHARACTER_NAMES_PATTERN, CHARACTER_NAMES = character_patterns(FRIENDS_PROFILE)
+
+def normalize_character_name(character, patterns=(MAIN_CHARACTER_PATTERN, CHARACTER_NAMES_PATTERN, CHARACTER_NAMES)):
+    """
+    Standardizes a single character name: removes descriptions in parentheses and trailing spaces after the names of the main characters,
+    and replaces all-uppercase or abbreviated names of the main characters with their standard capitalization.
+    The patterns default to the ones of the Friends script, other shows use the ones returned by character_patterns.
+    """
+    main_pattern, names_pattern, names = patterns
+    if main_pattern is not None:
+        character = main_pattern.sub(r"\1", character)
+    if names_pattern is not None:
+        character = names_pattern.sub(lambda match: names[match.group(0)], character)
+    return character
+
+def process_character_names(friends_script, profile=None):
     """
     Processes character names in the given 'friends_script' dataframe, standardizing their format and removing any 
     unnecessary information. Returns the updated 'friends_script' dataframe.
+    Only the distinct names are standardized, in a single pass, and the result is stored as a pandas Categorical.
     
     :param friends_script: Pandas dataframe containing information about each line in the Friends TV show script, including the character speaking.
+    :param profile: Parsing profile with the main cast of another show, defaults to the Friends characters.
     
-    :return: Pandas dataframe with the same columns as the input 'friends_script' dataframe, but with standardized character names.
+    :return: Pandas dataframe with the same columns as the input 'friends_script' dataframe, but with standardized character names as a categorical column.
     """
-    # Replace character names that include actions or descriptions
-    friends_script["character"] = friends_script["character"].str.replace(r"^(Ross|Rachel|Monica|Joey|Chandler|Phoebe) \(.+", r"\1", regex=True)
+    # Get the distinct raw names and the position of the name of every line among them
+    codes, raw_names = pd.factorize(friends_script["character"])
 
-    # Replace character names that have a single space after the name
-    friends_script["character"] = friends_script["character"].str.replace(r"^(Ross|Rachel|Monica|Joey|Chandler|Phoebe) $", r"\1", regex=True)
-    
-    # Replace all-uppercase character names with standardized capitalization
-    uppercase_names = {"MONICA": "Monica", "CHANDLER": "Chandler", "JOEY": "Joey", "PHOEBE": "Phoebe", "RACHELL": "Rachel", "ROSS": "Ross"}
-    friends_script["character"] = friends_script["character"].replace(uppercase_names, regex=True)
+    # Standardize every distinct name once, several raw names can end up with the same standard name
+    patterns = character_patterns(profile) if profile is not None else (MAIN_CHARACTER_PATTERN, CHARACTER_NAMES_PATTERN, CHARACTER_NAMES)
+    names = [normalize_character_name(str(name), patterns) for name in raw_names]
+    name_codes, categories = pd.factorize(pd.Series(names, dtype=object))
 
-    # Replace abbreviated character names with their full names
-    abrev_names = {"MNCA": "Monica", "CHAN": "Chandler", "JOEY": "Joey", "PHOE": "Phoebe", "RACH": "Rachel", "ROSS": "Ross"}
-    friends_script["character"] = friends_script["character"].replace(abrev_names, regex=True)
+    # Build the categorical column from the codes, keeping missing names as missing
+    codes = np.where(codes == -1, -1, name_codes[codes] if len(name_codes) else -1)
+    friends_script["character"] = pd.Categorical.from_codes(codes, categories=categories)
 
     return friends_script
 
-# Initialize the SentimentIntensityAnalyzer outside the function as this function is used in an apply and will slow down the process considerably.
-sia = SentimentIntensityAnalyzer()
+# The SentimentIntensityAnalyzer is created once, on first use, and shared by every call since creating it is slow.
+sia = None
+
+def get_sia():
+    """
+    Returns the shared SentimentIntensityAnalyzer, creating it the first time it is needed.
+    The VADER lexicon is looked up locally once and only downloaded if it is not installed.
+    """
+    global sia
+    if sia is None:
+        import nltk
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+        # Check the lexicon locally before trying to download it
+        try:
+            nltk.data.find('sentiment/vader_lexicon.zip')
+        except LookupError:
+            nltk.downloader.download('vader_lexicon', quiet = True)
+
+        sia = SentimentIntensityAnalyzer()
+    return sia
+
+# The batch version of the SentimentIntensityAnalyzer, created once on first use like sia.
+vader_batch = None
+
+def get_vader_batch():
+    """
+    Returns the shared VaderBatchScorer, which scores many lines at once with the lexicon and rules of the shared SentimentIntensityAnalyzer.
+    """
+    global vader_batch
+    if vader_batch is None:
+        vader_batch = VaderBatchScorer(get_sia())
+    return vader_batch
 
 def analyze_sentiment_sia(row):
     """
@@ -365,7 +621,7 @@ def analyze_sentiment_sia(row):
             The compound sentiment score for the text in the 'line' column of the input row.
     """
     # Apply sentiment analysis to the 'line' column of the input row using the SentimentIntensityAnalyzer from the nltk library
-    sentiment = sia.polarity_scores(row['line'])
+    sentiment = get_sia().polarity_scores(row['line'])
 
     # Return a new pandas Series containing the polarity scores for the input row
     return pd.Series(sentiment)
@@ -388,20 +644,72 @@ def analyze_sentiment_tb(row):
 
     """
     # Apply sentiment analysis to the 'line' column of the input row using the TextBlob library
+    from textblob import TextBlob
     sentiment = TextBlob(row['line']).sentiment
 
     # Return a new pandas Series containing the polarity scores for the input row
     return pd.Series(sentiment)
 
-def sentiment_analysis(friends_script):
+# Columns created by the sentiment analysis, in the same order as the score matrix returned by score_lines.
+SIA_COLUMNS = ['sia_neg', 'sia_neu', 'sia_pos', 'sia_compound']
+TB_COLUMNS = ['tb_polarity', 'tb_subjectivity']
+
+# Name and version of every analyzer, used as part of the key of the sentiment cache so that upgrading a library invalidates its cached scores.
+# The VADER scores come from VaderBatchScorer, so its version is part of the name too.
+SIA_ANALYZER = f"nltk-vader-{version('nltk')}-batch{SCORER_VERSION}"
+TB_ANALYZER = f"textblob-{version('textblob')}"
+
+def score_lines(lines):
+    """
+    Scores a chunk of lines with both the SentimentIntensityAnalyzer and TextBlob and returns the scores as a NumPy array.
+    This function is used by sentiment_analysis and runs inside the worker processes, so it only receives and returns plain lists and arrays.
+
+    Parameters:
+    ----------
+    lines : list of str
+        The lines of dialogue to analyze.
+
+    Returns:
+    -------
+    numpy.ndarray
+        An array of shape (len(lines), 6) with the columns sia_neg, sia_neu, sia_pos, sia_compound, tb_polarity and tb_subjectivity.
+    """
+    from textblob import TextBlob
+
+    # Preallocate the output array so that we only write the scores into it
+    scores = np.empty((len(lines), len(SIA_COLUMNS) + len(TB_COLUMNS)), dtype=np.float64)
+
+    # Score all the lines with SIA at once, this gives the same scores as sia.polarity_scores
+    scores[:, :len(SIA_COLUMNS)] = get_vader_batch().polarity_scores(lines)
+
+    for i, line in enumerate(lines):
+        # Score the line with TextBlob
+        tb_scores = TextBlob(line).sentiment
+        scores[i, 4] = tb_scores.polarity
+        scores[i, 5] = tb_scores.subjectivity
+
+    return scores
+
+def sentiment_analysis(friends_script, n_workers=None, chunk_size=2000, cache_path="data/sentiment_cache.sqlite", instrumentation=None):
     """
     Conducts sentiment analysis on the lines in the Friends script using both the SentimentIntensityAnalyzer 
-    and TextBlob. 
+    and TextBlob.
+    Every distinct line is only scored once and its scores are copied to all the rows with that line.
+    Scores of lines that were already analyzed are read from an on-disk cache. The remaining lines are split into chunks that are scored in parallel by a pool of worker processes, and the results are written into preallocated arrays and stored in the cache.
 
     Parameters:
     -----------
     friends_script: pandas.DataFrame
         DataFrame containing the Friends script data
+    n_workers: int, optional
+        Number of worker processes to use. Defaults to the number of CPUs of the machine, and never more than the number of chunks. Use 1 to score the lines in the current process,
+        which is also done when all the lines fit in a single chunk.
+    chunk_size: int, optional
+        Number of lines sent to a worker at a time.
+    cache_path: str, optional
+        Path of the sentiment cache file. Use None to score every line without a cache.
+    instrumentation: Instrumentation, optional
+        Receives the progress of the scoring (rows/sec and ETA) after every chunk.
 
     Returns:
     --------
@@ -410,17 +718,70 @@ def sentiment_analysis(friends_script):
         TextBlob
 
     """
-    # Print status messages to keep the user updated since this process can be very slow.
-    print("Starting sentiment analyisis with SIA... this will take a VERY long time")
-    
-    # Apply the function to each row and create new columns for the sentiment scores using SIA
-    friends_script[['sia_neg', 'sia_neu', 'sia_pos', 'sia_compound']] = friends_script.apply(analyze_sentiment_sia, axis=1)
-    
-    # Print status messages to keep the user updated since this process can be very slow.
-    print("Done!\nStarting sentiment analyisis with TextBlob... this one is faster")
-    
-    # Apply the function to each row and create new columns for the sentiment scores using TextBlob
-    friends_script[['tb_polarity', 'tb_subjectivity']] = friends_script.apply(analyze_sentiment_tb, axis=1)
+    # Many lines are repeated ("Hi!", "What?", "Yeah."), so every distinct line is only scored once and the scores are copied back to every row with the codes
+    # The distinct lines are kept as a plain list of strings so that they can be sent to the workers cheaply
+    codes, uniques = pd.factorize(friends_script['line'].astype(str))
+    lines = uniques.tolist()
+
+    # Preallocate the array that will hold the scores of every distinct line
+    scores = np.empty((len(lines), len(SIA_COLUMNS) + len(TB_COLUMNS)), dtype=np.float64)
+
+    # Read the scores already in the cache, a line only counts as cached if both analyzers have its scores
+    cache = SentimentCache(cache_path) if cache_path else None
+    if cache is not None:
+        sia_scores, sia_found = cache.get_many(SIA_ANALYZER, lines, len(SIA_COLUMNS))
+        tb_scores, tb_found = cache.get_many(TB_ANALYZER, lines, len(TB_COLUMNS))
+        scores[:, :len(SIA_COLUMNS)] = sia_scores
+        scores[:, len(SIA_COLUMNS):] = tb_scores
+        missing = np.flatnonzero(~(sia_found & tb_found))
+    else:
+        missing = np.arange(len(lines))
+
+    # Only the lines missing from the cache are scored
+    pending = [lines[i] for i in missing]
+    pending_scores = np.empty((len(pending), scores.shape[1]), dtype=np.float64)
+
+    # Split the lines into chunks, keeping the position of the first line of every chunk
+    chunks = [(start, pending[start:start + chunk_size]) for start in range(0, len(pending), chunk_size)]
+
+    # Print status messages to keep the user updated since this process can be slow.
+    print(f"Starting sentiment analyisis with SIA and TextBlob on {len(pending)} lines in {len(chunks)} chunks ({len(friends_script)} rows, {len(lines)} distinct lines, {len(lines) - len(pending)} read from the cache)...")
+
+    # Report how many rows were duplicates and the progress after every chunk, the first report starts the clock for the rows/sec and ETA
+    instrumentation = instrumentation or Instrumentation()
+    instrumentation.record("sentiment", unique_rows=len(lines), dedupe_ratio=round(len(friends_script) / max(len(lines), 1), 3))
+    done = 0
+    instrumentation.progress("sentiment", done, len(pending))
+
+    if n_workers == 1 or len(chunks) <= 1:
+        # Score every chunk in the current process, starting a pool for a single chunk costs more than it saves
+        for start, chunk in chunks:
+            pending_scores[start:start + len(chunk)] = score_lines(chunk)
+            done += len(chunk)
+            instrumentation.progress("sentiment", done, len(pending))
+    else:
+        # Score the chunks in parallel and copy every result into its place as soon as it is ready, there is no use for more workers than chunks
+        with ProcessPoolExecutor(max_workers=min(n_workers or os.cpu_count() or 1, len(chunks))) as executor:
+            futures = {executor.submit(score_lines, chunk): start for start, chunk in chunks}
+            for future in as_completed(futures):
+                start = futures[future]
+                chunk_scores = future.result()
+                pending_scores[start:start + len(chunk_scores)] = chunk_scores
+                done += len(chunk_scores)
+                instrumentation.progress("sentiment", done, len(pending))
+
+    # Put the new scores in place and store them in the cache
+    scores[missing] = pending_scores
+    if cache is not None:
+        if pending:
+            cache.put_many(SIA_ANALYZER, pending, pending_scores[:, :len(SIA_COLUMNS)])
+            cache.put_many(TB_ANALYZER, pending, pending_scores[:, len(SIA_COLUMNS):])
+        cache.close()
+
+    # Create the new columns for the sentiment scores using SIA and TextBlob, copying the scores of every distinct line to all its rows
+    scores = scores[codes]
+    friends_script[SIA_COLUMNS] = scores[:, :len(SIA_COLUMNS)]
+    friends_script[TB_COLUMNS] = scores[:, len(SIA_COLUMNS):]
     print("Done!")
 
     return friends_script
@@ -440,10 +801,10 @@ def rename_columns_for_sql(friends_script, f_seasons):
     friends_script = friends_script.rename(columns={'character': 'f_char', 'line' : 'f_line'})
     
     # Renames columns in f_seasons
-    f_seasons = f_seasons.rename(columns={'No.overall' : 'ep_number_overall', 'No. inseason':'ep_number_season', 'Title':'ep_title','Directed by' : "directed_by", "Written by":"written_by", "Original air date":"org_air_date", "Prod.code": "prod_code", "U.S. viewers(millions)" :"us_viewers_mm", "Rating(18–49)":"rating_1", "Rating/share(18–49)" : "rating_2", "Special No." : "special_num" , "U.S. viewersmillions" : "us_viewers_mm_2"})
+    f_seasons = f_seasons.rename(columns=SEASON_SQL_COLUMNS)
     return friends_script, f_seasons
 
-def clean_script(friends_script):
+def clean_script(friends_script, n_workers=None, cleaned=False, instrumentation=None):
     """
     This function takes a Pandas DataFrame containing the Friends script data and performs several data cleaning, 
     preprocessing, and feature engineering steps to prepare it for analysis. 
@@ -452,6 +813,12 @@ def clean_script(friends_script):
     -----------
     friends_script : pd.DataFrame
         A Pandas DataFrame containing the Friends script data.
+    n_workers : int, optional
+        Number of worker processes used for the sentiment analysis. Defaults to the number of CPUs of the machine.
+    cleaned : bool, optional
+        Set to True when the script was read with read_script, which already cleans it, to skip clean_friends_script.
+    instrumentation : Instrumentation, optional
+        Receives the duration, input and output rows and peak memory of every step, e.g. Instrumentation([LogSink()]).
     
     Returns:
     --------
@@ -460,37 +827,63 @@ def clean_script(friends_script):
         1. The cleaned Friends script DataFrame containing one row per line including the scene it belongs to and the character that spoke that line.
         2. A DataFrame containing information about each scene, description and episode number.
         3. A DataFrame containing information about each episode, including the episode title, air date and season.
+        The columns have the compact types declared in schemas.py (int32 keys, categorical characters and seasons, float32 scores and Arrow-backed strings).
     """
+    instrumentation = instrumentation or Instrumentation()
+
     # Clean Friends script
-    print("Cleaning Friends script...")
-    friends_script = clean_friends_script(friends_script)
+    if not cleaned:
+        print("Cleaning Friends script...")
+        with instrumentation.stage("clean", rows_in=len(friends_script)) as record:
+            friends_script = clean_friends_script(friends_script)
+            record["rows_out"] = len(friends_script)
 
     # Extract scene info
     print("Extracting scene info...")
-    f_scene_info = create_scene_info(friends_script)
+    with instrumentation.stage("scene_info", rows_in=len(friends_script)) as record:
+        f_scene_info = create_scene_info(friends_script)
+        record["rows_out"] = len(f_scene_info)
 
-    # Fetch season data from Wikipedia
+    # Fetch season data from Wikipedia or the local cache
     print("Fetching season data...")
-    f_seasons = get_seasons()
+    with instrumentation.stage("seasons") as record:
+        f_seasons = get_seasons()
+        record["rows_out"] = len(f_seasons)
 
     # Match episode names with seasons
     print("Matching episode names with seasons...")
-    f_scene_info, f_seasons = match_episodes(f_scene_info, f_seasons)
+    with instrumentation.stage("match_episodes", rows_in=len(f_scene_info)) as record:
+        f_scene_info, f_seasons = match_episodes(f_scene_info, f_seasons)
+        record["rows_out"] = len(f_scene_info)
 
     # Match episode names with script
     print("Matching episode names with script...")
-    friends_script = match_episode_numbers_in_script(friends_script,f_scene_info)
+    with instrumentation.stage("match_script", rows_in=len(friends_script)) as record:
+        friends_script = match_episode_numbers_in_script(friends_script,f_scene_info)
+        record["rows_out"] = len(friends_script)
 
     # Process character names to standarize them for matching
     print("Processing character names...")
-    friends_script = process_character_names(friends_script)
+    with instrumentation.stage("character_names", rows_in=len(friends_script)) as record:
+        friends_script = process_character_names(friends_script)
+        record["rows_out"] = len(friends_script)
     
     # Perform sentiment analysis using TextBlob and SIA
-    friends_script = sentiment_analysis(friends_script)
+    with instrumentation.stage("sentiment", rows_in=len(friends_script)) as record:
+        friends_script = sentiment_analysis(friends_script, n_workers=n_workers, instrumentation=instrumentation)
+        record["rows_out"] = len(friends_script)
 
     # Rename columns for easier processing with SQL
     print("Renaming columns for SQL...")
-    friends_script, f_seasons = rename_columns_for_sql(friends_script, f_seasons)
+    with instrumentation.stage("rename", rows_in=len(friends_script)) as record:
+        friends_script, f_seasons = rename_columns_for_sql(friends_script, f_seasons)
+        record["rows_out"] = len(friends_script)
+
+    # Downcast the results to the compact column types and check their schema
+    friends_script, f_scene_info, f_seasons = compact_frame(friends_script), compact_frame(f_scene_info), compact_frame(f_seasons)
+    validate_frame(friends_script, "friends_script")
+    validate_frame(f_scene_info, "f_scene_info")
+    validate_frame(f_seasons, "f_seasons")
     
     return friends_script, f_scene_info, f_seasons
 
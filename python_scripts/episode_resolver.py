@@ -0,0 +1,152 @@
+# This file declares the EpisodeResolver used by match_episodes in downloading_and_cleaning_func.py to match the episode titles found in the script with the episode titles from Wikipedia.
+import re
+import numpy as np
+import pandas as pd
+
+## Class declaration
+
+class EpisodeResolver:
+    """
+    Resolves episode titles, as spelled in a script, to episode numbers using a character n-gram index of the known episode titles.
+    Titles are normalized (lowercase, no apostrophes or punctuation) and compared using the Dice similarity of their sets of n-grams.
+    Titles that appear in several rows of the index are treated as episodes with several parts, and the part is taken from a "Part 1" / "Parts I And II" suffix in the title being resolved.
+
+    Parameters:
+    ----------
+    titles : list of str
+        The known episode titles. A title that joins several alternative titles (e.g. "The One Hundredththe One With The Triplets") is indexed under every alternative.
+    episodes : list of str
+        The episode number of every title.
+    aliases : dict, optional
+        Titles that can not be matched by similarity mapped directly to their episode number.
+    threshold : float, optional
+        Minimum similarity between 0 and 1 for a title to be matched.
+    ngram : int, optional
+        Length of the character n-grams.
+    """
+
+    # Suffixes that identify a part of an episode with several parts
+    PART_PATTERN = re.compile(r"\s*\bparts?\s+(\d+|[ivx]+)(\s+and\s+(\d+|[ivx]+))?$")
+    ROMAN_NUMERALS = {"i": 1, "ii": 2, "iii": 3, "iv": 4, "v": 5}
+
+    def __init__(self, titles, episodes, aliases=None, threshold=0.75, ngram=3):
+        self.threshold = threshold
+        self.ngram = ngram
+        self.aliases = {self.normalize(title): episode for title, episode in (aliases or {}).items()}
+
+        # Group the episode numbers by normalized title, every alternative of a title is indexed separately
+        groups = {}
+        for title, episode in zip(titles, episodes):
+            if pd.isna(title):
+                continue
+            for alternative in re.split(r"(?<=\S)(?=the One\b)", str(title)):
+                episodes_of_title = groups.setdefault(self.normalize(alternative), [])
+                if episode not in episodes_of_title:
+                    episodes_of_title.append(episode)
+        self.titles = list(groups)
+        self.episodes = [sorted(group, key=self.episode_sort_key) for group in groups.values()]
+
+        # Build the vocabulary of n-grams and the matrix with the n-grams of every title
+        self.vocabulary = {}
+        title_ngrams = [self.ngrams(title) for title in self.titles]
+        for ngrams in title_ngrams:
+            for gram in ngrams:
+                self.vocabulary.setdefault(gram, len(self.vocabulary))
+        self.matrix = self.to_matrix(title_ngrams)
+        self.sizes = self.matrix.sum(axis=1)
+
+    @staticmethod
+    def normalize(title):
+        """
+        Returns the title in lowercase, without apostrophes and with every other punctuation sign replaced by a space.
+        """
+        title = title.lower().replace("'", "").replace("’", "")
+        return re.sub(r"[^a-z0-9]+", " ", title).strip()
+
+    @staticmethod
+    def episode_sort_key(episode):
+        """
+        Sorts episode numbers numerically, putting values that are not numbers last.
+        """
+        try:
+            return (0, int(episode))
+        except (TypeError, ValueError):
+            return (1, str(episode))
+
+    def ngrams(self, title):
+        """
+        Returns the set of character n-grams of a normalized title, padded with a space on each side.
+        """
+        title = f" {title} "
+        return {title[i:i + self.ngram] for i in range(len(title) - self.ngram + 1)}
+
+    def to_matrix(self, ngram_sets):
+        """
+        Returns a matrix with one row for every set of n-grams and a 1 in the columns of the n-grams of the vocabulary it contains.
+        """
+        matrix = np.zeros((len(ngram_sets), len(self.vocabulary)), dtype=np.float32)
+        for i, ngrams in enumerate(ngram_sets):
+            matrix[i, [self.vocabulary[gram] for gram in ngrams if gram in self.vocabulary]] = 1
+        return matrix
+
+    def split_part(self, title):
+        """
+        Splits a normalized title into the title without its part suffix and the number of the part (1 if there is no suffix).
+        """
+        match = self.PART_PATTERN.search(title)
+        if not match:
+            return title, 1
+        part = match.group(1)
+        part = int(part) if part.isdigit() else self.ROMAN_NUMERALS.get(part, 1)
+        return title[:match.start()].strip(), part
+
+    def resolve(self, titles):
+        """
+        Resolves several titles at once. Every distinct title is only compared once, and all of them are compared to every known title in a single matrix product.
+
+        Parameters:
+        ----------
+        titles : array-like of str
+            The titles to resolve.
+
+        Returns:
+        -------
+        pandas.DataFrame
+            A DataFrame with one row for every input title and the columns:
+            - episode : the episode number, or None if no title was similar enough.
+            - score : the similarity with the best matching known title.
+        """
+        titles = pd.Series(titles, dtype=object)
+        codes, unique_titles = pd.factorize(titles)
+        if len(unique_titles) == 0:
+            return pd.DataFrame({"episode": None, "score": 0.0}, index=titles.index)
+
+        # Normalize every distinct title and separate the part of multi-part episodes
+        normalized = [self.normalize(str(title)) for title in unique_titles]
+        base_titles, parts = zip(*[self.split_part(title) for title in normalized])
+
+        # Compute the similarity of every distinct title with every known title
+        queries = self.to_matrix([self.ngrams(title) for title in base_titles])
+        query_sizes = np.array([len(self.ngrams(title)) for title in base_titles], dtype=np.float32)
+        overlap = queries @ self.matrix.T
+        similarity = 2 * overlap / (query_sizes[:, None] + self.sizes[None, :])
+        best = similarity.argmax(axis=1)
+        scores = similarity[np.arange(len(base_titles)), best].astype(np.float64)
+
+        # Pick the episode of the best match, the part of multi-part episodes and the aliases
+        episodes = []
+        for i, title in enumerate(normalized):
+            if title in self.aliases:
+                episodes.append(self.aliases[title])
+                scores[i] = 1.0
+            elif scores[i] >= self.threshold:
+                group = self.episodes[best[i]]
+                episodes.append(group[min(parts[i], len(group)) - 1])
+            else:
+                episodes.append(None)
+
+        # Broadcast the results back to every input title
+        episodes = np.array(episodes, dtype=object)
+        result = pd.DataFrame({"episode": episodes[codes], "score": scores[codes]}, index=titles.index)
+        result.loc[codes == -1, ["episode", "score"]] = [None, 0.0]
+        return result
@@ -0,0 +1,206 @@
+# This file declares the instrumentation used by clean_script, sentiment_analysis and the pipeline runner to report how long every stage takes,
+# how many rows go in and out, the peak memory used and, for long stages, the progress with rows/sec and ETA.
+# Metrics are sent to pluggable sinks: structured (JSON) log lines, a JSON metrics file and a Prometheus text file.
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+## Memory measurement
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of the process, so that the next measure only includes the current stage.
+    This is only possible on Linux, on other systems the peak since the start of the process is measured.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+def peak_rss_bytes():
+    """
+    Returns the peak resident memory of the process in bytes, or None if it can not be measured (e.g. on Windows, which has no resource module).
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+## Sinks
+
+class LogSink:
+    """
+    Writes every event as a JSON line to a stream (standard output by default).
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def emit(self, event):
+        self.stream.write(json.dumps(event) + "\n")
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+class JsonFileSink:
+    """
+    Collects the metrics of every finished stage and writes them to a JSON file when the run is closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = []
+
+    def emit(self, event):
+        if event["event"] == "stage_end":
+            self.stages.append(event)
+
+    def close(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "stages": self.stages}, f, indent=1)
+
+class PrometheusSink:
+    """
+    Writes the metrics of every finished stage to a file in the Prometheus text format when the run is closed, e.g. for the node exporter textfile collector.
+    """
+
+    METRICS = [
+        ("duration_seconds", "seconds", "Wall time of the stage in seconds"),
+        ("rows_in", "rows_in", "Number of rows that went into the stage"),
+        ("rows_out", "rows_out", "Number of rows that came out of the stage"),
+        ("peak_rss_bytes", "peak_rss_bytes", "Peak resident memory during the stage in bytes"),
+        ("dedupe_ratio", "dedupe_ratio", "Number of rows for every distinct row processed by the stage"),
+    ]
+
+    def __init__(self, path, prefix="friends_pipeline_stage"):
+        self.path = path
+        self.prefix = prefix
+        self.stages = []
+
+    def emit(self, event):
+        if event["event"] == "stage_end":
+            self.stages.append(event)
+
+    def close(self):
+        lines = []
+        for metric, key, description in self.METRICS:
+            name = f"{self.prefix}_{metric}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for stage in self.stages:
+                if stage.get(key) is not None:
+                    lines.append(f'{name}{{stage="{stage["stage"]}"}} {stage[key]}')
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Write to a temporary file first so that the collector never reads a half written file
+        with open(self.path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+## Instrumentation
+
+class Instrumentation:
+    """
+    Measures the stages of a run and sends the events to the sinks. Without sinks it does nothing, so it can always be passed around.
+
+    Parameters:
+    ----------
+    sinks : list, optional
+        Objects with emit(event) and close() methods, e.g. LogSink, JsonFileSink and PrometheusSink.
+    progress_interval : float, optional
+        Minimum number of seconds between two progress events of the same stage.
+    """
+
+    def __init__(self, sinks=None, progress_interval=5.0):
+        self.sinks = list(sinks or [])
+        self.progress_interval = progress_interval
+        self.progress_state = {}
+        # Records of the stages that are running, extra statistics reported with record() are added to them
+        self.open_stages = {}
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink.emit(event)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Context manager that measures a stage. The block can set record["rows_out"] on the yielded record with the number of rows it produced.
+
+        Example:
+            with instrumentation.stage("clean", rows_in=len(df)) as record:
+                df = clean(df)
+                record["rows_out"] = len(df)
+        """
+        record = {"event": "stage_end", "stage": name, "rows_in": rows_in, "rows_out": None}
+        if not self.sinks:
+            yield record
+            return
+
+        self.emit({"event": "stage_start", "stage": name, "rows_in": rows_in, "time": time.time()})
+        self.open_stages[name] = record
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.open_stages.pop(name, None)
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            if record["rows_in"] and record["seconds"] > 0:
+                record["rows_per_sec"] = round(record["rows_in"] / record["seconds"], 1)
+            self.emit(record)
+
+    def record(self, name, **stats):
+        """
+        Reports extra statistics of a stage, e.g. the share of duplicated rows. If the stage is running they are added to its "stage_end" record,
+        otherwise they are sent right away as a "stats" event.
+        """
+        if not self.sinks:
+            return
+        if name in self.open_stages:
+            self.open_stages[name].update(stats)
+        else:
+            self.emit({"event": "stats", "stage": name, **stats})
+
+    def progress(self, name, done, total):
+        """
+        Reports the progress of a long stage, with the rows/sec since the first call for this stage and the estimated time left.
+        Events are sent at most once every progress_interval seconds, except for the last one.
+        """
+        if not self.sinks:
+            return
+        now = time.perf_counter()
+        start, last = self.progress_state.setdefault(name, (now, 0.0))
+        if done < total and now - last < self.progress_interval:
+            return
+        self.progress_state[name] = (start, now)
+
+        elapsed = now - start
+        rate = done / elapsed if elapsed > 0 else None
+        eta = (total - done) / rate if rate else None
+        self.emit({"event": "progress", "stage": name, "done": done, "total": total,
+                   "rows_per_sec": round(rate, 1) if rate else None, "eta_seconds": round(eta, 1) if eta is not None else None})
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,114 @@
+# This file declares functions to export the cleaned Friends DataFrames to typed, compressed Parquet files and to read them back.
+# The Parquet files keep the types of every column, so reading them is much faster than parsing the '~' separated CSV files and gives back the same DataFrames.
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from python_scripts.schemas import compact_frame
+
+## Schemas of the exported tables
+
+SCRIPT_SCHEMA = pa.schema([
+    ("f_char", pa.dictionary(pa.int32(), pa.string())),
+    ("f_line", pa.string()),
+    ("scene_number", pa.int32()),
+    ("sia_neg", pa.float32()),
+    ("sia_neu", pa.float32()),
+    ("sia_pos", pa.float32()),
+    ("sia_compound", pa.float32()),
+    ("tb_polarity", pa.float32()),
+    ("tb_subjectivity", pa.float32()),
+])
+
+SCENES_SCHEMA = pa.schema([
+    ("scene_number", pa.int32()),
+    # Matched episodes hold the episode number as text, episodes that could not be matched keep their title
+    ("episode", pa.string()),
+    ("scene", pa.string()),
+])
+
+SEASONS_SCHEMA = pa.schema([
+    ("ep_number_overall", pa.string()),
+    ("ep_number_season", pa.int32()),
+    ("ep_title", pa.string()),
+    ("directed_by", pa.string()),
+    ("written_by", pa.string()),
+    ("org_air_date", pa.string()),
+    ("prod_code", pa.string()),
+    ("us_viewers_mm", pa.string()),
+    ("season", pa.dictionary(pa.int32(), pa.int32())),
+    ("rating_1", pa.string()),
+    ("rating_2", pa.string()),
+    ("special_num", pa.string()),
+    ("us_viewers_mm_2", pa.string()),
+])
+
+# File name and schema of every table
+TABLES = {
+    "script": SCRIPT_SCHEMA,
+    "scenes": SCENES_SCHEMA,
+    "seasons": SEASONS_SCHEMA,
+}
+
+## Function declaration
+
+def to_arrow_table(df, schema):
+    """
+    Converts a DataFrame to a pyarrow Table with the given schema. Only the columns of the schema are kept, integer columns stored as text are converted to numbers first
+    and every other column is cast to the type of the schema.
+
+    Parameters:
+    df (pandas DataFrame): The DataFrame to convert.
+    schema (pyarrow.Schema): The schema of the resulting table.
+
+    Returns:
+    pyarrow.Table: A table with exactly the columns and types of the schema.
+    """
+    df = df[schema.names].copy()
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name])
+        elif pa.types.is_string(field.type):
+            df[field.name] = df[field.name].map(lambda x: None if pd.isna(x) else str(x))
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+def export_friends_info_parquet(friends_script, f_seasons, f_scene_info, folder="data/", compression="zstd"):
+    """
+    Export cleaned Friends script, season info and scene info as typed, compressed Parquet files
+
+    Parameters:
+    friends_script (pandas DataFrame): cleaned Friends script
+    f_seasons (pandas DataFrame): Friends TV show seasons data
+    f_scene_info (pandas DataFrame): scene information from Friends script
+    folder (str): folder where the files script.parquet, scenes.parquet and seasons.parquet are written
+    compression (str): compression codec used for the Parquet files
+
+    Returns:
+    None
+    """
+    frames = {"script": friends_script, "scenes": f_scene_info, "seasons": f_seasons}
+    os.makedirs(folder, exist_ok=True)
+
+    for name, schema in TABLES.items():
+        table = to_arrow_table(frames[name], schema)
+        pq.write_table(table, os.path.join(folder, f"{name}.parquet"), compression=compression)
+
+    print(f"Done! exported Parquet files to '{folder}' ")
+
+def read_friends_info_parquet(folder="data/"):
+    """
+    Reads the Parquet files exported by export_friends_info_parquet. The files are memory-mapped and the columns get the compact types
+    declared in schemas.py (f_char and season come back as categorical columns, text as Arrow-backed strings).
+
+    Parameters:
+    folder (str): folder with the files script.parquet, scenes.parquet and seasons.parquet
+
+    Returns:
+    Tuple[friends_script, f_scene_info, f_seasons]: the three DataFrames.
+    """
+    frames = {}
+    for name in TABLES:
+        table = pq.read_table(os.path.join(folder, f"{name}.parquet"), memory_map=True)
+        frames[name] = compact_frame(table.to_pandas())
+
+    return frames["script"], frames["scenes"], frames["seasons"]
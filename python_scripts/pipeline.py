@@ -0,0 +1,284 @@
+# This file declares a pipeline runner that performs the same steps as clean_script in downloading_and_cleaning_func.py, but as named stages that save their outputs.
+# Every stage stores its outputs as Parquet files together with a fingerprint of its code and of its inputs. When the pipeline is run again,
+# every stage whose fingerprint did not change is skipped and its outputs are read from disk, so changing a single step only re-runs that step and the ones that depend on its output.
+#
+# It can be run from the command line, e.g.:
+#   python -m python_scripts.pipeline --transcript data/Friends_Transcript.txt
+#   python -m python_scripts.pipeline --force character_names
+#   python -m python_scripts.pipeline --from sentiment
+import os
+import json
+import inspect
+import hashlib
+import argparse
+import pandas as pd
+from python_scripts import downloading_and_cleaning_func as d_c, text_index
+from python_scripts.instrumentation import Instrumentation, LogSink, JsonFileSink, PrometheusSink
+from python_scripts.schemas import compact_frame, validate_frame, validate_output
+
+## Stage declaration
+
+def run_clean(data, options):
+    return {"friends_script": d_c.read_script(options["transcript"])}
+
+def run_scene_info(data, options):
+    return {"f_scene_info": d_c.create_scene_info(data["friends_script"])}
+
+def run_seasons(data, options):
+    return {"f_seasons_raw": d_c.get_seasons(offline=options.get("offline", False))}
+
+def transcript_sources(options):
+    return [hash_file(options["transcript"])]
+
+def seasons_sources(options):
+    # The downloaded page, the parsed table and the snapshot the seasons are read from, and whether get_seasons will refresh the cached table
+    table_path = os.path.join(d_c.SEASONS_CACHE_DIR, "seasons_wikipedia.csv")
+    paths = [os.path.join(d_c.SEASONS_CACHE_DIR, d_c.SEASONS_HTML), table_path, d_c.SEASONS_SNAPSHOT]
+    refresh = not options.get("offline", False) and not d_c.is_fresh(table_path, 30)
+    return [hash_file(path) if os.path.exists(path) else "missing" for path in paths] + [f"refresh={refresh}"]
+
+def run_match_episodes(data, options):
+    f_scene_info, f_seasons = d_c.match_episodes(data["f_scene_info"].copy(), data["f_seasons_raw"])
+    return {"f_scene_info_matched": f_scene_info, "f_seasons_matched": f_seasons}
+
+def run_match_script(data, options):
+    return {"script_matched": d_c.match_episode_numbers_in_script(data["friends_script"], data["f_scene_info_matched"])}
+
+def run_sentiment(data, options):
+    return {"script_scored": d_c.sentiment_analysis(data["script_matched"].copy(), n_workers=options.get("n_workers"), instrumentation=options.get("instrumentation"))}
+
+def run_character_names(data, options):
+    return {"script_named": d_c.process_character_names(data["script_scored"].copy())}
+
+def run_rename(data, options):
+    friends_script, f_seasons = d_c.rename_columns_for_sql(data["script_named"], data["f_seasons_matched"])
+    return {"friends_script_final": friends_script, "f_seasons_final": f_seasons}
+
+def run_line_index(data, options):
+    return {"line_index": text_index.build_index(data["friends_script_final"])}
+
+# The stages in the order they run. "code" lists the functions and constants whose source is part of the fingerprint of the stage,
+# and "sources" returns the hashes of the files read by the stage, which are part of the fingerprint too.
+# The sentiment analysis only depends on the lines, so it runs before the character names are processed: changing how names are processed does not re-score the lines.
+STAGES = [
+    {"name": "clean", "run": run_clean, "inputs": [], "outputs": ["friends_script"], "sources": transcript_sources,
+     "code": [d_c.read_script, d_c.stream_script, d_c.process_line, d_c.FRIENDS_PROFILE]},
+    {"name": "scene_info", "run": run_scene_info, "inputs": ["friends_script"], "outputs": ["f_scene_info"],
+     "code": [d_c.create_scene_info]},
+    {"name": "seasons", "run": run_seasons, "inputs": [], "outputs": ["f_seasons_raw"], "sources": seasons_sources,
+     "code": [d_c.get_seasons, d_c.parse_seasons_html, d_c.load_seasons_snapshot]},
+    {"name": "match_episodes", "run": run_match_episodes, "inputs": ["f_scene_info", "f_seasons_raw"], "outputs": ["f_scene_info_matched", "f_seasons_matched"],
+     "code": [d_c.match_episodes, d_c.split_multi_part_episodes, d_c.MULTI_PART_EPISODES, d_c.EPISODE_ALIASES, d_c.EpisodeResolver]},
+    {"name": "match_script", "run": run_match_script, "inputs": ["friends_script", "f_scene_info_matched"], "outputs": ["script_matched"],
+     "code": [d_c.match_episode_numbers_in_script]},
+    {"name": "sentiment", "run": run_sentiment, "inputs": ["script_matched"], "outputs": ["script_scored"],
+     "code": [d_c.sentiment_analysis, d_c.score_lines, d_c.VaderBatchScorer, d_c.SIA_ANALYZER, d_c.TB_ANALYZER]},
+    {"name": "character_names", "run": run_character_names, "inputs": ["script_scored"], "outputs": ["script_named"],
+     "code": [d_c.process_character_names, d_c.normalize_character_name, d_c.character_patterns, d_c.FRIENDS_PROFILE]},
+    {"name": "rename", "run": run_rename, "inputs": ["script_named", "f_seasons_matched"], "outputs": ["friends_script_final", "f_seasons_final"],
+     "code": [d_c.rename_columns_for_sql, d_c.SEASON_SQL_COLUMNS]},
+    {"name": "line_index", "run": run_line_index, "inputs": ["friends_script_final"], "outputs": ["line_index"],
+     "code": [text_index.build_index, text_index.TOKEN_PATTERN]},
+]
+
+STAGE_NAMES = [stage["name"] for stage in STAGES]
+
+# Outputs returned by the pipeline and the name of their schema in schemas.FRAME_COLUMNS
+FINAL_OUTPUTS = {"friends_script_final": "friends_script", "f_scene_info_matched": "f_scene_info", "f_seasons_final": "f_seasons"}
+
+## Function declaration
+
+def hash_code(objects):
+    """
+    Returns a hash of the source code of the given functions and classes, or of the repr of any other value.
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        source = inspect.getsource(obj) if inspect.isfunction(obj) or inspect.isclass(obj) else repr(obj)
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
+
+def hash_frame(df):
+    """
+    Returns a hash of the content of a DataFrame, including its index, column names and types.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+def hash_file(path):
+    """
+    Returns a hash of the content of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class PipelineRunner:
+    """
+    Runs the STAGES of the cleaning pipeline, skipping the stages whose code and inputs did not change since their outputs were saved.
+
+    Parameters:
+    ----------
+    checkpoint_dir : str
+        Folder where the outputs and fingerprints of every stage are saved.
+    options : dict
+        Options passed to the stages: "transcript" (path of the script .txt file), "n_workers", "offline" and "instrumentation"
+        (an Instrumentation that receives the duration, rows and peak memory of every stage that runs).
+    """
+
+    def __init__(self, checkpoint_dir="data/checkpoints", **options):
+        self.checkpoint_dir = checkpoint_dir
+        self.options = options
+        self.instrumentation = options.get("instrumentation") or Instrumentation()
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def meta_path(self, stage_name):
+        return os.path.join(self.checkpoint_dir, f"{stage_name}.json")
+
+    def output_path(self, output_name):
+        return os.path.join(self.checkpoint_dir, f"{output_name}.parquet")
+
+    def read_output(self, output_name):
+        """
+        Reads a saved output with the compact column types, Parquet does not keep every pandas type (e.g. categories of numbers).
+        """
+        return compact_frame(pd.read_parquet(self.output_path(output_name)))
+
+    def validate(self, output_name, df):
+        """
+        Checks an output before it is saved, so that a malformed output is reported by the stage that produced it and never saved as a checkpoint.
+        The final outputs are checked against the schema of clean_script, the intermediate ones against schemas.STAGE_OUTPUTS.
+        """
+        if output_name in FINAL_OUTPUTS:
+            validate_frame(df, FINAL_OUTPUTS[output_name])
+        else:
+            validate_output(df, output_name)
+
+    def fingerprint(self, stage, input_hashes):
+        """
+        Returns the fingerprint of a stage: a hash of its name, its code and the content of its inputs, and of the files it reads (the transcript for the clean stage,
+        the Wikipedia page and the cached or bundled season tables for the seasons stage).
+        """
+        parts = [stage["name"], hash_code(stage["code"])] + input_hashes
+        if "sources" in stage:
+            parts += stage["sources"](self.options)
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def load_meta(self, stage_name):
+        if not os.path.exists(self.meta_path(stage_name)):
+            return None
+        with open(self.meta_path(stage_name), "r") as f:
+            return json.load(f)
+
+    def run(self, from_stage=None, force=()):
+        """
+        Runs the pipeline.
+
+        Parameters:
+        ----------
+        from_stage : str, optional
+            Name of a stage that is re-run together with every stage after it, even if their fingerprints did not change.
+        force : iterable of str, optional
+            Names of stages that are re-run even if their fingerprints did not change.
+
+        Returns:
+        -------
+        Tuple[friends_script, f_scene_info, f_seasons]
+            The same three DataFrames returned by clean_script.
+        """
+        for name in ([from_stage] if from_stage else []) + list(force):
+            if name not in STAGE_NAMES:
+                raise ValueError(f"Unknown stage '{name}', the stages are: {', '.join(STAGE_NAMES)}")
+
+        data = {}
+        hashes = {}
+        rerun_all = False
+
+        for stage in STAGES:
+            rerun_all = rerun_all or stage["name"] == from_stage
+            key = self.fingerprint(stage, [hashes[name] for name in stage["inputs"]])
+            meta = self.load_meta(stage["name"])
+            outputs_saved = all(os.path.exists(self.output_path(name)) for name in stage["outputs"])
+
+            if not rerun_all and stage["name"] not in force and meta is not None and meta["fingerprint"] == key and outputs_saved:
+                # Nothing changed, the outputs are only read when a later stage needs them
+                print(f"Skipping stage '{stage['name']}' (unchanged)")
+                hashes.update(meta["outputs"])
+                continue
+
+            # Read the inputs saved by stages that were skipped
+            for name in stage["inputs"]:
+                if name not in data:
+                    data[name] = self.read_output(name)
+
+            # Run the stage, downcast its outputs to the compact column types and save them with the fingerprint
+            print(f"Running stage '{stage['name']}'...")
+            rows_in = len(data[stage["inputs"][0]]) if stage["inputs"] else None
+            with self.instrumentation.stage(stage["name"], rows_in=rows_in) as record:
+                outputs = stage["run"](data, self.options)
+                record["rows_out"] = len(next(iter(outputs.values())))
+            for name, df in outputs.items():
+                df = compact_frame(df)
+                self.validate(name, df)
+                df.to_parquet(self.output_path(name))
+                hashes[name] = hash_frame(df)
+                data[name] = df
+
+            # A stage can update the files it reads (the seasons stage caches the table it downloads), the saved fingerprint describes them after the run
+            if "sources" in stage:
+                key = self.fingerprint(stage, [hashes[name] for name in stage["inputs"]])
+            with open(self.meta_path(stage["name"]), "w") as f:
+                json.dump({"fingerprint": key, "outputs": {name: hashes[name] for name in stage["outputs"]}}, f, indent=1)
+
+        # Read the final outputs of the skipped stages and check their schema
+        for name, schema_name in FINAL_OUTPUTS.items():
+            if name not in data:
+                data[name] = self.read_output(name)
+                validate_frame(data[name], schema_name)
+
+        return data["friends_script_final"], data["f_scene_info_matched"], data["f_seasons_final"]
+
+def main(argv=None):
+    """
+    Command line interface of the pipeline runner. Runs the pipeline and exports the results like 1-download_and_clean_data.py.
+    """
+    parser = argparse.ArgumentParser(description="Run the Friends script cleaning pipeline, skipping the stages that did not change.")
+    parser.add_argument("--transcript", default="data/Friends_Transcript.txt", help="path of the script .txt file")
+    parser.add_argument("--checkpoint-dir", default="data/checkpoints", help="folder where the outputs of every stage are saved")
+    parser.add_argument("--from", dest="from_stage", choices=STAGE_NAMES, help="re-run this stage and every stage after it")
+    parser.add_argument("--force", action="append", default=[], choices=STAGE_NAMES, help="re-run this stage (can be repeated)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes for the sentiment analysis")
+    parser.add_argument("--offline", action="store_true", help="never use the network to fetch the season data")
+    parser.add_argument("--no-export", action="store_true", help="do not export the results to data/")
+    parser.add_argument("--log-metrics", action="store_true", help="print the metrics of every stage as JSON lines")
+    parser.add_argument("--metrics-json", help="write the metrics of every stage to this JSON file")
+    parser.add_argument("--metrics-prom", help="write the metrics of every stage to this file in the Prometheus text format")
+    args = parser.parse_args(argv)
+
+    sinks = [LogSink()] if args.log_metrics else []
+    if args.metrics_json:
+        sinks.append(JsonFileSink(args.metrics_json))
+    if args.metrics_prom:
+        sinks.append(PrometheusSink(args.metrics_prom))
+    instrumentation = Instrumentation(sinks)
+
+    runner = PipelineRunner(args.checkpoint_dir, transcript=args.transcript, n_workers=args.workers, offline=args.offline, instrumentation=instrumentation)
+    try:
+        friends_script, f_scene_info, f_seasons = runner.run(from_stage=args.from_stage, force=args.force)
+    finally:
+        instrumentation.close()
+
+    if not args.no_export:
+        from python_scripts import parquet_io
+        d_c.export_friends_info_csv(friends_script, f_seasons, f_scene_info)
+        parquet_io.export_friends_info_parquet(friends_script, f_seasons, f_scene_info)
+        text_index.save_index(runner.read_output("line_index"), friends_script)
+
+    return friends_script, f_scene_info, f_seasons
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# This file declares the in-memory schema of the cleaned Friends DataFrames and the functions that enforce it.
+# Keys are stored as int32, characters and seasons as categories, sentiment scores as float32 and text as Arrow-backed strings,
+# which takes several times less memory than the object and float64 columns produced by pandas by default.
+# The pipeline runner downcasts the output of every stage with compact_frame and checks it before saving it, with validate_frame for the final DataFrames
+# and validate_output for the intermediate ones.
+import numpy as np
+import pandas as pd
+
+## Column types
+
+# Text stored in Arrow buffers instead of one Python object per value
+STRING = pd.StringDtype("pyarrow")
+
+# Type of every column, under the names used before and after rename_columns_for_sql
+COLUMN_TYPES = {
+    "scene_number": "int32",
+    "character": "category",
+    "f_char": "category",
+    "line": STRING,
+    "f_line": STRING,
+    "episode": STRING,
+    "scene": STRING,
+    "sia_neg": "float32",
+    "sia_neu": "float32",
+    "sia_pos": "float32",
+    "sia_compound": "float32",
+    "tb_polarity": "float32",
+    "tb_subjectivity": "float32",
+    "season": "category",
+    "ep_number_overall": STRING,
+    "ep_number_season": "int32",
+    "ep_title": STRING,
+    "directed_by": STRING,
+    "written_by": STRING,
+    "org_air_date": STRING,
+    "prod_code": STRING,
+    "us_viewers_mm": STRING,
+    "rating_1": STRING,
+    "rating_2": STRING,
+    "special_num": STRING,
+    "us_viewers_mm_2": STRING,
+}
+
+# Columns of the three DataFrames returned by clean_script, in order
+FRAME_COLUMNS = {
+    "friends_script": ["f_char", "f_line", "scene_number", "sia_neg", "sia_neu", "sia_pos", "sia_compound", "tb_polarity", "tb_subjectivity"],
+    "f_scene_info": ["scene_number", "episode", "scene"],
+    "f_seasons": ["ep_number_overall", "ep_number_season", "ep_title", "directed_by", "written_by", "org_air_date", "prod_code",
+                  "us_viewers_mm", "season", "rating_1", "rating_2", "special_num", "us_viewers_mm_2"],
+}
+
+# Columns of the intermediate outputs saved by the pipeline runner, and the key columns that can not have missing values.
+# The outputs that are also returned by clean_script are checked with FRAME_COLUMNS instead.
+SCORE_COLUMNS = ["sia_neg", "sia_neu", "sia_pos", "sia_compound", "tb_polarity", "tb_subjectivity"]
+SEASON_COLUMNS = ["No.overall", "No. inseason", "Title", "season"]
+STAGE_OUTPUTS = {
+    "friends_script": {"columns": ["episode", "scene", "scene_number", "character", "line"], "keys": ["line"]},
+    "f_scene_info": {"columns": ["scene_number", "episode", "scene"], "keys": ["scene_number", "episode"]},
+    "f_seasons_raw": {"columns": SEASON_COLUMNS, "keys": ["No.overall", "season"]},
+    "f_seasons_matched": {"columns": SEASON_COLUMNS, "keys": ["No.overall", "season"]},
+    "script_matched": {"columns": ["character", "line", "scene_number"], "keys": ["line", "scene_number"]},
+    "script_scored": {"columns": ["character", "line", "scene_number"] + SCORE_COLUMNS, "keys": ["line", "scene_number"] + SCORE_COLUMNS},
+    "script_named": {"columns": ["character", "line", "scene_number"] + SCORE_COLUMNS, "keys": ["line", "scene_number"] + SCORE_COLUMNS},
+    "line_index": {"columns": ["term", "row_id", "position"], "keys": ["term", "row_id", "position"]},
+}
+
+# Decimals kept when the float32 scores are widened back to float64 at the storage boundaries (SQL tables and extracts): VADER rounds its scores
+# to at most 4 decimals, TextBlob does not round, so its scores keep the 6 significant decimals of float32.
+STORAGE_DECIMALS = {"sia_neg": 4, "sia_neu": 4, "sia_pos": 4, "sia_compound": 4, "tb_polarity": 6, "tb_subjectivity": 6}
+
+## Function declaration
+
+def cast_column(series, dtype):
+    """
+    Casts a column to the given type. Integer columns are parsed from text if needed and use the nullable Int32 type if they have missing values,
+    categorical columns of numbers (e.g. the season) get numeric categories.
+
+    Raises:
+    ValueError: if an integer column has values that are not numbers or do not fit in 32 bits.
+    """
+    if dtype == "int32":
+        values = pd.to_numeric(series, errors="raise")
+        if values.notna().any() and (values.min() < np.iinfo(np.int32).min or values.max() > np.iinfo(np.int32).max):
+            raise ValueError(f"Column '{series.name}' has values that do not fit in int32")
+        return values.astype("Int32" if values.isna().any() else "int32")
+    if dtype == "category":
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series
+        numbers = pd.to_numeric(series, errors="coerce")
+        if series.notna().any() and numbers.notna().sum() == series.notna().sum():
+            return numbers.astype("Int32" if numbers.isna().any() else "int32").astype("category")
+        return series.astype("category")
+    return series.astype(dtype)
+
+def is_type(series, dtype):
+    """
+    Returns True if the column already has the given type (an integer column with missing values may use the nullable Int32 type).
+    """
+    if dtype == "category":
+        return isinstance(series.dtype, pd.CategoricalDtype)
+    if dtype == "int32":
+        return series.dtype in (np.dtype("int32"), pd.Int32Dtype())
+    return series.dtype == dtype
+
+def compact_frame(df):
+    """
+    Returns the DataFrame with every column listed in COLUMN_TYPES cast to its compact type. Other columns are left as they are.
+
+    Parameters:
+    df (pandas DataFrame): The DataFrame to downcast.
+
+    Returns:
+    pandas DataFrame: A new DataFrame with the same columns and values.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in COLUMN_TYPES and not is_type(df[column], COLUMN_TYPES[column]):
+            df[column] = cast_column(df[column], COLUMN_TYPES[column])
+    return df
+
+def validate_frame(df, name):
+    """
+    Checks that a DataFrame returned by clean_script has exactly the columns of FRAME_COLUMNS[name], in order, with the types of COLUMN_TYPES.
+
+    Parameters:
+    df (pandas DataFrame): The DataFrame to check.
+    name (str): One of "friends_script", "f_scene_info" or "f_seasons".
+
+    Raises:
+    ValueError: if a column is missing, unexpected or has the wrong type.
+    """
+    expected = FRAME_COLUMNS[name]
+    if list(df.columns) != expected:
+        raise ValueError(f"'{name}' has the columns {list(df.columns)}, expected {expected}")
+
+    wrong_types = [f"{column} ({df[column].dtype}, expected {COLUMN_TYPES[column]})" for column in expected if not is_type(df[column], COLUMN_TYPES[column])]
+    if wrong_types:
+        raise ValueError(f"'{name}' has columns with the wrong type: {', '.join(wrong_types)}")
+
+    # The keys of the final DataFrames can not be missing
+    if "scene_number" in df.columns and df["scene_number"].isna().any():
+        raise ValueError(f"'{name}' has rows without a scene number")
+
+def validate_output(df, name):
+    """
+    Checks an intermediate output of the pipeline before it is saved: it must have the columns of STAGE_OUTPUTS[name] (other columns are allowed),
+    every column listed in COLUMN_TYPES must have its compact type and the key columns can not have missing values.
+
+    Parameters:
+    df (pandas DataFrame): The output to check, already downcast with compact_frame.
+    name (str): Name of the output in STAGE_OUTPUTS.
+
+    Raises:
+    ValueError: if a column is missing, has the wrong type or a key column has missing values.
+    """
+    spec = STAGE_OUTPUTS[name]
+    missing = [column for column in spec["columns"] if column not in df.columns]
+    if missing:
+        raise ValueError(f"'{name}' is missing the columns {missing}")
+
+    wrong_types = [f"{column} ({df[column].dtype}, expected {COLUMN_TYPES[column]})" for column in df.columns
+                   if column in COLUMN_TYPES and not is_type(df[column], COLUMN_TYPES[column])]
+    if wrong_types:
+        raise ValueError(f"'{name}' has columns with the wrong type: {', '.join(wrong_types)}")
+
+    missing_keys = [column for column in spec["keys"] if df[column].isna().any()]
+    if missing_keys:
+        raise ValueError(f"'{name}' has missing values in the key columns {missing_keys}")
+
+def to_storage(df):
+    """
+    Returns the DataFrame with the float32 score columns widened to float64 and rounded to STORAGE_DECIMALS, so that the databases and the files
+    read by other tools get 0.741 instead of 0.7409999966621399. The compact float32 columns are only used inside the process and in the Parquet files.
+    """
+    df = df.copy()
+    for column, decimals in STORAGE_DECIMALS.items():
+        if column in df.columns and df[column].dtype == np.float32:
+            df[column] = df[column].astype("float64").round(decimals)
+    return df
@@ -0,0 +1,143 @@
+# This file declares a persistent cache for the sentiment scores of the lines of the script. It is used by sentiment_analysis in downloading_and_cleaning_func.py so that lines that were already scored are never scored again.
+import os
+import time
+import hashlib
+import sqlite3
+import numpy as np
+
+## Class declaration
+
+class SentimentCache:
+    """
+    On-disk cache of sentiment scores stored in a SQLite file.
+    Every entry is keyed by a hash of the analyzer name and version together with the text of the line, so a new version of an analyzer never reuses old scores.
+    When the cache grows over max_entries the least recently used entries are evicted.
+
+    Parameters:
+    ----------
+    path : str
+        Path of the SQLite file that stores the cache.
+    max_entries : int
+        Maximum number of entries kept in the cache after every write.
+    """
+
+    # SQLite limits the number of parameters in a single query, so lookups are done in batches of this size.
+    BATCH_SIZE = 900
+
+    # The workers of corpus.run_batch share the cache file, a worker waits up to this many seconds for the lock of another one instead of failing.
+    TIMEOUT_SECONDS = 60
+
+    def __init__(self, path="data/sentiment_cache.sqlite", max_entries=1_000_000):
+        self.path = path
+        self.max_entries = max_entries
+
+        # Create the folder of the cache file if it does not exist yet
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        # Open the database and create the table that holds the scores. In WAL mode the lookups of a worker are not blocked while another one writes.
+        self.connection = sqlite3.connect(path, timeout=self.TIMEOUT_SECONDS)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                key TEXT PRIMARY KEY,
+                scores BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(analyzer, line):
+        """
+        Returns the cache key of a line for the given analyzer, a SHA-256 hash of the analyzer name and version and the text of the line.
+        """
+        return hashlib.sha256(f"{analyzer}\0{line}".encode("utf-8")).hexdigest()
+
+    def get_many(self, analyzer, lines, width):
+        """
+        Looks up the scores of several lines for one analyzer.
+
+        Parameters:
+        ----------
+        analyzer : str
+            Name and version of the analyzer, e.g. "nltk-vader-3.8.1".
+        lines : list of str
+            The lines to look up.
+        width : int
+            Number of scores the analyzer returns for every line.
+
+        Returns:
+        -------
+        Tuple[numpy.ndarray, numpy.ndarray]
+            An array of shape (len(lines), width) with the cached scores (NaN for lines not in the cache) and a boolean array that is True for the lines that were found.
+        """
+        keys = [self.make_key(analyzer, line) for line in lines]
+        scores = np.full((len(lines), width), np.nan, dtype=np.float64)
+        found = np.zeros(len(lines), dtype=bool)
+
+        # Map every key to the positions where it appears, since the same line can appear several times
+        positions = {}
+        for i, key in enumerate(keys):
+            positions.setdefault(key, []).append(i)
+
+        # Query the cache in batches and copy the scores found into their positions
+        unique_keys = list(positions)
+        for start in range(0, len(unique_keys), self.BATCH_SIZE):
+            batch = unique_keys[start:start + self.BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(f"SELECT key, scores FROM scores WHERE key IN ({placeholders})", batch).fetchall()
+            for key, blob in rows:
+                idx = positions[key]
+                scores[idx] = np.frombuffer(blob, dtype=np.float64)
+                found[idx] = True
+
+            # Mark the entries found as recently used so that they are not evicted
+            if rows:
+                now = time.time()
+                self.connection.executemany("UPDATE scores SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+
+        self.connection.commit()
+        return scores, found
+
+    def put_many(self, analyzer, lines, scores):
+        """
+        Stores the scores of several lines for one analyzer and evicts the least recently used entries if the cache is over its size cap.
+
+        Parameters:
+        ----------
+        analyzer : str
+            Name and version of the analyzer.
+        lines : list of str
+            The lines that were scored.
+        scores : numpy.ndarray
+            Array of shape (len(lines), width) with the scores of every line.
+        """
+        now = time.time()
+        scores = np.ascontiguousarray(scores, dtype=np.float64)
+        rows = [(self.make_key(analyzer, line), scores[i].tobytes(), now) for i, line in enumerate(lines)]
+        self.connection.executemany("INSERT OR REPLACE INTO scores (key, scores, last_used) VALUES (?, ?, ?)", rows)
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache holds at most max_entries entries.
+        """
+        count = self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute("""
+                DELETE FROM scores WHERE key IN (
+                    SELECT key FROM scores ORDER BY last_used ASC LIMIT ?
+                )""", (count - self.max_entries,))
+            self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the connection to the cache file.
+        """
+        self.connection.close()
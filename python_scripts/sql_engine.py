@@ -0,0 +1,151 @@
+# This file declares the shared SQLAlchemy engines used by 2-uploading_to_sql.py, analytics.py and the notebook, and functions to read large query results in chunks.
+# Engines are created once per URL with a connection pool, so every script and notebook cell reuses the same connections, and connections are checked
+# before use (pre-ping) so that a connection dropped by the server is replaced instead of failing the query.
+# Large results are read with a server-side cursor and returned chunk by chunk as DataFrames or Arrow record batches, so they never have to fit in memory, e.g.:
+#   for chunk in sql_engine.stream_query(sql_engine.LINES_WITH_SEASONS):
+#       ...
+#   sql_engine.export_query_csv(sql_engine.LINES_WITH_SEASONS, "data/lines_with_seasons.csv")
+import os
+import pandas as pd
+import pyarrow as pa
+import sqlalchemy as alch
+from python_scripts import parquet_io, sql_loader
+
+# Settings of the connection pool of server databases
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+POOL_RECYCLE_SECONDS = 3600
+
+# Number of rows read from the server at a time
+CHUNK_SIZE = 10000
+
+# Every line with its character, scene, episode and season metadata, the largest export used for the Tableau extracts
+LINES_WITH_SEASONS = f"""
+    SELECT scr.id AS id, scr.f_char AS f_char, scr.f_line AS f_line, scr.scene_number AS scene_number, sce.episode AS episode,
+        sea.season AS season, sea.ep_number_season AS ep_number_season, sea.ep_title AS ep_title, sea.org_air_date AS org_air_date,
+        scr.sia_neg AS sia_neg, scr.sia_neu AS sia_neu, scr.sia_pos AS sia_pos, scr.sia_compound AS sia_compound,
+        scr.tb_polarity AS tb_polarity, scr.tb_subjectivity AS tb_subjectivity
+    {sql_loader.SCRIPT_JOIN}
+    ORDER BY scr.id"""
+
+# Arrow types of the columns of the query results, the types of the Parquet exports (without their dictionary encoding, every batch has its own values)
+# plus the primary keys and the columns of the rollup tables. Columns that are not here get the type of their values in the first chunk.
+ARROW_TYPES = {
+    **{field.name: field.type.value_type if pa.types.is_dictionary(field.type) else field.type for schema in parquet_io.TABLES.values() for field in schema},
+    "id": pa.int64(),
+    "num_lines": pa.int64(),
+    "sentiment": pa.float64(),
+    "tb_sentiment": pa.float64(),
+}
+
+# Engines already created, by URL
+engines = {}
+
+## Function declaration
+
+def mysql_url():
+    """
+    Returns the URL of the MySQL "friends" database, with the password of the SQL_PASSWORD environment variable (or .env file).
+    The user, host and database can be changed with the SQL_USER, SQL_HOST and SQL_DATABASE variables.
+    """
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    user = os.getenv("SQL_USER", "root")
+    password = os.getenv("SQL_PASSWORD")
+    host = os.getenv("SQL_HOST", "localhost")
+    database = os.getenv("SQL_DATABASE", "friends")
+    return f"mysql+pymysql://{user}:{password}@{host}/{database}"
+
+def get_engine(url=None):
+    """
+    Returns the shared engine for a database URL, creating it the first time. Server databases get a pool of POOL_SIZE connections
+    (plus MAX_OVERFLOW extra ones under load) that are recycled after POOL_RECYCLE_SECONDS and checked with a ping before every use.
+
+    Parameters:
+    url (str): SQLAlchemy URL of the database, defaults to the MySQL database of mysql_url.
+
+    Returns:
+    sqlalchemy Engine: The shared engine.
+    """
+    url = url or mysql_url()
+    if url not in engines:
+        if url.startswith("sqlite"):
+            # SQLite opens a local file, it does not need a server connection pool
+            engines[url] = alch.create_engine(url, pool_pre_ping=True)
+        else:
+            engines[url] = alch.create_engine(url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_recycle=POOL_RECYCLE_SECONDS, pool_pre_ping=True)
+    return engines[url]
+
+def dispose_engine(url=None):
+    """
+    Closes the connections of the shared engine of a URL and forgets it, e.g. before the database file is replaced.
+    """
+    engine = engines.pop(url or mysql_url(), None)
+    if engine is not None:
+        engine.dispose()
+
+def stream_query(query, engine=None, chunk_size=CHUNK_SIZE, params=None):
+    """
+    Runs a query and yields its result as DataFrames of at most chunk_size rows. The rows are read with a server-side cursor,
+    so only one chunk is held in memory at a time. A query without rows yields a single empty DataFrame with the columns of the query, like pandas.read_sql.
+
+    Parameters:
+    query (str): The SQL query.
+    engine (sqlalchemy Engine): Database to query, defaults to the shared MySQL engine.
+    chunk_size (int): Number of rows of every DataFrame.
+    params (dict): Parameters of the query.
+    """
+    engine = engine or get_engine()
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(alch.text(query), params or {})
+        columns = list(result.keys())
+        empty = True
+        for rows in result.partitions(chunk_size):
+            empty = False
+            yield pd.DataFrame(rows, columns=columns)
+        if empty:
+            yield pd.DataFrame([], columns=columns)
+
+def arrow_schema(chunk):
+    """
+    Returns the Arrow schema of the chunks of a query: the type of every column in ARROW_TYPES, or else the type of its values in the chunk.
+    A column that is only nulls in the chunk and is not in ARROW_TYPES is read as text.
+    """
+    fields = []
+    for column in chunk.columns:
+        if column in ARROW_TYPES:
+            fields.append(pa.field(column, ARROW_TYPES[column]))
+            continue
+        inferred = pa.Array.from_pandas(chunk[column]).type
+        fields.append(pa.field(column, pa.string() if pa.types.is_null(inferred) else inferred))
+    return pa.schema(fields)
+
+def stream_arrow(query, engine=None, chunk_size=CHUNK_SIZE, params=None, schema=None):
+    """
+    Same as stream_query, but yields pyarrow RecordBatches. Every batch has the same schema, so the batches can be written to a single Arrow or Parquet file.
+
+    Parameters:
+    schema (pyarrow Schema): Schema of the batches, with a field for every column of the query. Defaults to the types of arrow_schema, so a column
+    that is only nulls in the first chunk still gets its declared type.
+    """
+    for chunk in stream_query(query, engine, chunk_size, params):
+        schema = schema or arrow_schema(chunk)
+        yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+def export_query_csv(query, path, engine=None, chunk_size=CHUNK_SIZE, params=None, sep=","):
+    """
+    Writes the result of a query to a CSV file chunk by chunk, e.g. to build a Tableau extract from LINES_WITH_SEASONS without loading every line in memory.
+    The header line is always written, even if the query returns no rows.
+
+    Returns:
+    int: Number of rows written.
+    """
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(stream_query(query, engine, chunk_size, params)):
+            chunk.to_csv(f, sep=sep, index=False, header=i == 0)
+            rows += len(chunk)
+    return rows
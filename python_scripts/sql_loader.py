@@ -0,0 +1,239 @@
+# This file declares the functions used by 2-uploading_to_sql.py to load the cleaned Friends DataFrames into SQL.
+# Every table is created with explicit column types and a primary key, filled in batches in a staging table and then swapped in place of the old table,
+# so the old data stays available until the new data is completely loaded.
+# After loading, the join keys used by the analysis queries are indexed and pre-aggregated rollup tables are built for the notebook and the Tableau dashboard.
+import sqlalchemy as alch
+from python_scripts.schemas import to_storage
+
+## Table definitions
+
+def script_columns():
+    return [
+        alch.Column("id", alch.Integer, primary_key=True, autoincrement=False),
+        alch.Column("f_char", alch.String(255)),
+        alch.Column("f_line", alch.Text),
+        alch.Column("scene_number", alch.Integer, nullable=False),
+        alch.Column("sia_neg", alch.Float),
+        alch.Column("sia_neu", alch.Float),
+        alch.Column("sia_pos", alch.Float),
+        alch.Column("sia_compound", alch.Float),
+        alch.Column("tb_polarity", alch.Float),
+        alch.Column("tb_subjectivity", alch.Float),
+    ]
+
+def scenes_columns():
+    return [
+        alch.Column("scene_number", alch.Integer, primary_key=True, autoincrement=False),
+        alch.Column("episode", alch.String(255)),
+        alch.Column("scene", alch.Text),
+    ]
+
+def seasons_columns():
+    return [
+        alch.Column("id", alch.Integer, primary_key=True, autoincrement=False),
+        alch.Column("ep_number_overall", alch.String(20)),
+        alch.Column("ep_number_season", alch.Integer),
+        alch.Column("ep_title", alch.String(255)),
+        alch.Column("directed_by", alch.Text),
+        alch.Column("written_by", alch.Text),
+        alch.Column("org_air_date", alch.Text),
+        alch.Column("prod_code", alch.Text),
+        alch.Column("us_viewers_mm", alch.Text),
+        alch.Column("season", alch.Integer),
+        alch.Column("rating_1", alch.Text),
+        alch.Column("rating_2", alch.Text),
+        alch.Column("special_num", alch.Text),
+        alch.Column("us_viewers_mm_2", alch.Text),
+    ]
+
+# Functions that build the columns of every table, columns can not be shared between the final and the staging tables so they are built on demand
+TABLE_COLUMNS = {
+    "script": script_columns,
+    "scenes": scenes_columns,
+    "seasons": seasons_columns,
+}
+
+# Columns of every table that are indexed, these are the join keys and grouping columns of the analysis queries
+TABLE_INDEXES = {
+    "script": ["scene_number", "f_char"],
+    "scenes": ["episode"],
+    "seasons": ["ep_number_overall", "season"],
+}
+
+# Join of every line with its scene and season, the same join used by the queries of the notebook
+SCRIPT_JOIN = """
+    FROM script AS scr
+    LEFT JOIN scenes AS sce
+        ON scr.scene_number = sce.scene_number
+    LEFT JOIN seasons AS sea
+        ON sea.ep_number_overall = sce.episode"""
+
+# Pre-aggregated tables with the number of lines and the average sentiment of every group
+ROLLUPS = {
+    "sentiment_by_character": f"""
+        SELECT scr.f_char AS f_char, COUNT(scr.f_char) AS num_lines, AVG(scr.sia_compound) AS sentiment, AVG(scr.tb_polarity) AS tb_sentiment
+        {SCRIPT_JOIN}
+        GROUP BY scr.f_char""",
+    "sentiment_by_season": f"""
+        SELECT sea.season AS season, COUNT(*) AS num_lines, AVG(scr.sia_compound) AS sentiment, AVG(scr.tb_polarity) AS tb_sentiment
+        {SCRIPT_JOIN}
+        GROUP BY sea.season""",
+    "sentiment_by_season_character": f"""
+        SELECT sea.season AS season, scr.f_char AS f_char, COUNT(scr.f_char) AS num_lines, AVG(scr.sia_compound) AS sentiment, AVG(scr.tb_polarity) AS tb_sentiment
+        {SCRIPT_JOIN}
+        GROUP BY sea.season, scr.f_char""",
+    "sentiment_by_episode": f"""
+        SELECT sea.season AS season, sce.episode AS episode, MAX(sea.ep_title) AS ep_title, COUNT(*) AS num_lines, AVG(scr.sia_compound) AS sentiment, AVG(scr.tb_polarity) AS tb_sentiment
+        {SCRIPT_JOIN}
+        GROUP BY sea.season, sce.episode""",
+    "sentiment_by_scene": f"""
+        SELECT scr.scene_number AS scene_number, sce.episode AS episode, COUNT(*) AS num_lines, AVG(scr.sia_compound) AS sentiment, AVG(scr.tb_polarity) AS tb_sentiment
+        {SCRIPT_JOIN}
+        GROUP BY scr.scene_number, sce.episode""",
+}
+
+# Number of tables replaced in every database by this process, by URL. It is part of the key of the query cache of analytics.py,
+# so the results cached before an upload are never returned after it.
+table_generations = {}
+
+## Function declaration
+
+def make_table(name, table_name=None):
+    """
+    Returns a new SQLAlchemy Table with the columns of the table 'name', optionally under a different table name (used for the staging tables).
+    """
+    return alch.Table(table_name or name, alch.MetaData(), *TABLE_COLUMNS[name]())
+
+def iter_batches(df, table, batch_size):
+    """
+    Yields the rows of a DataFrame as lists of dictionaries of at most batch_size rows, with only the columns of the table.
+    Missing values are turned into None, text columns into str and the primary key "id", if the DataFrame does not have it, into the row position.
+    The float32 sentiment scores are widened to float64 and rounded with schemas.to_storage, so the database stores the scores as computed.
+
+    Parameters:
+    df (pandas DataFrame): The DataFrame to load.
+    table (sqlalchemy.Table): The table the rows are loaded into.
+    batch_size (int): Number of rows of every batch.
+    """
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size].copy()
+        if "id" in table.columns and "id" not in batch.columns:
+            batch["id"] = range(start, start + len(batch))
+        batch = to_storage(batch[[column.name for column in table.columns]])
+
+        # Convert every value to a plain Python value accepted by the database driver
+        batch = batch.astype(object).where(batch.notna(), None)
+        for column in table.columns:
+            if isinstance(column.type, alch.String):
+                batch[column.name] = batch[column.name].map(lambda x: x if x is None else str(x))
+
+        yield batch.to_dict("records")
+
+def create_indexes(connection, name, table_name=None):
+    """
+    Creates the indexes in TABLE_INDEXES for the table 'name', optionally on a table with a different name (the staging table).
+    The indexes are always named after the final table, "ix_<table>_<column>".
+    """
+    table = alch.Table(table_name or name, alch.MetaData(), autoload_with=connection)
+    for column in TABLE_INDEXES.get(name, []):
+        alch.Index(f"ix_{name}_{column}", table.c[column]).create(connection)
+
+def swap_tables(connection, name, staging_name):
+    """
+    Replaces the table 'name' with the table 'staging_name'. In MySQL this is done with a single RENAME TABLE statement, which is atomic.
+    Other databases (e.g. SQLite) support transactional DDL, so the drop and rename are done inside a transaction. Python's sqlite3 module does not
+    start a transaction before DDL statements, so for SQLite it is started explicitly, otherwise the DROP TABLE would be committed on its own.
+    In MySQL index names belong to their table, so the indexes are created on the staging table before the swap. In other databases index names
+    can be shared by the whole database, so they are created after the old table is dropped, in the same transaction.
+    """
+    exists = alch.inspect(connection).has_table(name)
+    preparer = connection.dialect.identifier_preparer
+    quoted_name = preparer.quote(name)
+    quoted_staging = preparer.quote(staging_name)
+    quoted_old = preparer.quote(f"{name}_old")
+
+    if connection.dialect.name == "mysql":
+        create_indexes(connection, name, staging_name)
+        connection.execute(alch.text(f"DROP TABLE IF EXISTS {quoted_old}"))
+        if exists:
+            connection.execute(alch.text(f"RENAME TABLE {quoted_name} TO {quoted_old}, {quoted_staging} TO {quoted_name}"))
+            connection.execute(alch.text(f"DROP TABLE {quoted_old}"))
+        else:
+            connection.execute(alch.text(f"RENAME TABLE {quoted_staging} TO {quoted_name}"))
+    else:
+        if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+        if exists:
+            connection.execute(alch.text(f"DROP TABLE {quoted_name}"))
+        connection.execute(alch.text(f"ALTER TABLE {quoted_staging} RENAME TO {quoted_name}"))
+        create_indexes(connection, name)
+
+def load_table(engine, name, df, batch_size=5000):
+    """
+    Loads a DataFrame into the SQL table 'name'. The rows are inserted in batches into a staging table, which then replaces the existing table.
+
+    Parameters:
+    engine (sqlalchemy Engine): Connection to the database.
+    name (str): Name of the table, one of "script", "scenes" or "seasons".
+    df (pandas DataFrame): The DataFrame to load.
+    batch_size (int): Number of rows inserted with every multi-row INSERT.
+
+    Returns:
+    int: Number of rows loaded.
+    """
+    staging_name = f"{name}_staging"
+    staging = make_table(name, staging_name)
+
+    # Create an empty staging table with the final column types and primary key
+    staging.drop(engine, checkfirst=True)
+    staging.create(engine)
+
+    # Insert the rows in batches, each batch is sent as a single executemany
+    with engine.begin() as connection:
+        for records in iter_batches(df, staging, batch_size):
+            connection.execute(staging.insert(), records)
+
+    # Replace the old table with the staging table
+    with engine.begin() as connection:
+        swap_tables(connection, name, staging_name)
+    table_generations[str(engine.url)] = table_generations.get(str(engine.url), 0) + 1
+
+    return len(df)
+
+def build_rollups(engine):
+    """
+    Builds the tables in ROLLUPS from the uploaded script, scenes and seasons tables. Every rollup is created in a staging table with CREATE TABLE ... AS SELECT
+    and then swapped in place of the old one.
+
+    Parameters:
+    engine (sqlalchemy Engine): Connection to the database.
+    """
+    preparer = engine.dialect.identifier_preparer
+    for name, query in ROLLUPS.items():
+        staging_name = f"{name}_staging"
+        with engine.begin() as connection:
+            connection.execute(alch.text(f"DROP TABLE IF EXISTS {preparer.quote(staging_name)}"))
+            connection.execute(alch.text(f"CREATE TABLE {preparer.quote(staging_name)} AS {query}"))
+        with engine.begin() as connection:
+            swap_tables(connection, name, staging_name)
+        table_generations[str(engine.url)] = table_generations.get(str(engine.url), 0) + 1
+        print(f"Built rollup table '{name}'")
+
+def upload_friends_info(engine, friends_script, f_scene_info, f_seasons, batch_size=5000, rollups=True):
+    """
+    Uploads the cleaned Friends script, scene info and season info to the tables "script", "scenes" and "seasons".
+
+    Parameters:
+    engine (sqlalchemy Engine): Connection to the database.
+    friends_script (pandas DataFrame): cleaned Friends script
+    f_scene_info (pandas DataFrame): scene information from Friends script
+    f_seasons (pandas DataFrame): Friends TV show seasons data
+    batch_size (int): Number of rows inserted at a time.
+    rollups (bool): If True the rollup tables are built after the upload.
+    """
+    for name, df in [("script", friends_script), ("scenes", f_scene_info), ("seasons", f_seasons)]:
+        rows = load_table(engine, name, df, batch_size)
+        print(f"Uploaded {rows} rows to '{name}'")
+
+    if rollups:
+        build_rollups(engine)
@@ -0,0 +1,242 @@
+# This file declares an inverted index of the words of the lines of the script, used to find the lines that mention a topic, catchphrase or character
+# without scanning the whole f_line column (LIKE '%...%' in SQL or str.contains in pandas).
+# The lines are tokenized once, after the cleaning, and every word is stored with the row id (the position of the line in script.parquet, the "id" of the script table in SQL)
+# and the position of the word in the line, so that phrases can be found too. The index is saved as a sorted, dictionary-encoded Parquet file (data/line_index.parquet), e.g.:
+#   index = text_index.load_line_index()
+#   index.search("how you doin")                 # lines with all the words
+#   index.search("how you doin", phrase=True)    # lines with the words in this order
+#   index.sentiment_by_character("coffee")       # average sentiment of the lines that mention coffee
+import os
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from python_scripts import parquet_io
+
+# Path of the exported index
+LINE_INDEX_PATH = "data/line_index.parquet"
+
+# Words are runs of letters and digits, with apostrophes inside them ("don't", "y'know"), compared in lowercase
+TOKEN_PATTERN = r"[a-z0-9]+(?:'[a-z0-9]+)*"
+TOKEN_REGEX = re.compile(TOKEN_PATTERN)
+
+# Schema of the exported index, one row for every word of every line, sorted by term, row id and position
+INDEX_SCHEMA = pa.schema([
+    ("term", pa.dictionary(pa.int32(), pa.string())),
+    ("row_id", pa.int32()),
+    ("position", pa.int32()),
+])
+
+# Columns of the lines returned by a search, besides the ones of the corpus (show, season) when they are there
+RESULT_COLUMNS = ["id", "f_char", "scene_number", "episode", "sia_compound", "f_line"]
+
+## Function declaration
+
+def tokenize(text):
+    """
+    Returns the lowercase words of a text, the same way the lines are tokenized when the index is built.
+    """
+    return TOKEN_REGEX.findall(str(text).lower())
+
+def lines_fingerprint(lines):
+    """
+    Returns a hash of the lines the index is built from, saved with the index to know if it must be rebuilt.
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(lines.astype(str), index=False).values.tobytes()).hexdigest()
+
+def build_index(friends_script):
+    """
+    Tokenizes the f_line column and returns the postings of the inverted index: one row for every word of every line.
+    Every distinct line is only tokenized once and its words are copied to all the rows with that line.
+
+    Parameters:
+    friends_script (pandas DataFrame): The cleaned script, with the f_line column.
+
+    Returns:
+    pandas DataFrame: The columns term (categorical), row_id and position (int32), sorted by term, row id and position.
+    """
+    # Tokenize the distinct lines
+    codes, uniques = pd.factorize(friends_script["f_line"].astype(str))
+    unique_tokens = pd.Series(uniques, dtype=object).str.lower().str.findall(TOKEN_PATTERN)
+    unique_counts = unique_tokens.str.len().to_numpy(dtype=np.int64)
+    unique_starts = np.cumsum(unique_counts) - unique_counts
+    flat_tokens = unique_tokens.explode().dropna().to_numpy(dtype=object)
+
+    # Give every word a term id, in alphabetical order
+    term_codes, terms = pd.factorize(flat_tokens, sort=True)
+
+    # Copy the words of every distinct line to all its rows, keeping the position of every word in its line
+    row_counts = unique_counts[codes]
+    row_ids = np.repeat(np.arange(len(codes), dtype=np.int32), row_counts)
+    row_starts = np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+    positions = (np.arange(len(row_ids), dtype=np.int64) - row_starts).astype(np.int32)
+    row_terms = term_codes[np.repeat(unique_starts[codes], row_counts) + positions]
+
+    # Sort the postings by term, then by row id and position
+    order = np.lexsort((positions, row_ids, row_terms))
+    return pd.DataFrame({
+        "term": pd.Categorical.from_codes(row_terms[order], categories=pd.Index(terms, dtype=object)),
+        "row_id": row_ids[order],
+        "position": positions[order],
+    })
+
+def save_index(postings, friends_script, path=LINE_INDEX_PATH, compression="zstd"):
+    """
+    Writes the postings to a Parquet file, together with the fingerprint of the lines they were built from.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    table = pa.Table.from_pandas(postings, schema=INDEX_SCHEMA, preserve_index=False)
+    table = table.replace_schema_metadata({"lines": lines_fingerprint(friends_script["f_line"]), "rows": str(len(friends_script))})
+    pq.write_table(table, path, compression=compression)
+
+def load_line_index(folder="data/", path=LINE_INDEX_PATH):
+    """
+    Reads the Parquet files exported by 1-download_and_clean_data.py and the index of their lines, building the index first
+    if it does not exist or if the lines changed since it was built.
+
+    Parameters:
+    folder (str): Folder with the files script.parquet and scenes.parquet.
+    path (str): Path of the index.
+
+    Returns:
+    LineIndex: The index, ready to be searched.
+    """
+    friends_script, f_scene_info, _ = parquet_io.read_friends_info_parquet(folder)
+
+    postings = None
+    if os.path.exists(path):
+        table = pq.read_table(path, memory_map=True)
+        if (table.schema.metadata or {}).get(b"lines", b"").decode() == lines_fingerprint(friends_script["f_line"]):
+            postings = table.to_pandas()
+
+    if postings is None:
+        print(f"Building the line index '{path}'...")
+        postings = build_index(friends_script)
+        save_index(postings, friends_script, path)
+
+    return LineIndex(postings, friends_script, f_scene_info)
+
+## Class declaration
+
+class LineIndex:
+    """
+    Inverted index of the words of the lines of a script, with the lines it was built from.
+
+    Parameters:
+    ----------
+    postings : pandas DataFrame
+        The postings returned by build_index.
+    friends_script : pandas DataFrame
+        The script the postings were built from, in the same order. A corpus read with corpus.read_corpus works too, its show and season columns are kept in the results.
+    f_scene_info : pandas DataFrame, optional
+        The scenes, used to add the episode of every line. Not needed if the script already has an episode column.
+    """
+
+    # Row ids and positions are combined into a single number to find phrases, lines have less words than this
+    MAX_POSITION = 1 << 20
+
+    def __init__(self, postings, friends_script, f_scene_info=None):
+        # The postings of every term are a slice of the row id and position arrays, the slices start at offsets[term code]
+        self.terms = pd.Index(postings["term"].cat.categories)
+        term_codes = postings["term"].cat.codes.to_numpy()
+        self.row_ids = postings["row_id"].to_numpy(dtype=np.int64)
+        self.positions = postings["position"].to_numpy(dtype=np.int64)
+
+        # Reading a file with several row groups can give the terms in another order, the postings of every term stay sorted with a stable sort
+        if len(term_codes) and (np.diff(term_codes) < 0).any():
+            order = np.argsort(term_codes, kind="stable")
+            term_codes, self.row_ids, self.positions = term_codes[order], self.row_ids[order], self.positions[order]
+        self.offsets = np.searchsorted(term_codes, np.arange(len(self.terms) + 1))
+
+        # The lines, with their episode, by row id
+        lines = friends_script.reset_index(drop=True)
+        if f_scene_info is not None:
+            episodes = f_scene_info.drop_duplicates("scene_number").set_index("scene_number")["episode"]
+            lines = lines.assign(episode=lines["scene_number"].map(episodes))
+        lines = lines.assign(id=np.arange(len(lines)))
+        self.lines = lines[[column for column in ["show", "season"] if column in lines.columns] + RESULT_COLUMNS]
+
+    def postings(self, term):
+        """
+        Returns the row ids and positions of a word, empty arrays if the word is not in the index.
+        """
+        code = self.terms.get_indexer([term])[0]
+        if code == -1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return self.row_ids[start:end], self.positions[start:end]
+
+    def rows_with(self, term):
+        """
+        Returns the sorted, distinct row ids of the lines that contain a word.
+        """
+        rows, _ = self.postings(term)
+        # The row ids of a term are sorted, a word repeated in a line gives consecutive equal row ids
+        return rows[np.concatenate([[True], rows[1:] != rows[:-1]])] if len(rows) else rows
+
+    def match(self, query, phrase=False):
+        """
+        Returns the sorted row ids of the lines that contain every word of the query, or the words of the query in this order if phrase is True.
+        """
+        words = tokenize(query)
+        if not words:
+            return np.zeros(0, dtype=np.int64)
+
+        if not phrase:
+            # Intersect the rows of the rarest words first so that the intermediate results stay small
+            row_sets = sorted((self.rows_with(word) for word in words), key=len)
+            rows = row_sets[0]
+            for other in row_sets[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            return rows
+
+        # A phrase matches where the k-th word is found k positions after the first one, in the same row
+        keys = None
+        for k, word in enumerate(words):
+            rows, positions = self.postings(word)
+            word_keys = np.unique(rows * self.MAX_POSITION + positions - k)
+            keys = word_keys if keys is None else np.intersect1d(keys, word_keys, assume_unique=True)
+        return np.unique(keys // self.MAX_POSITION)
+
+    def search(self, query, phrase=False, characters=None):
+        """
+        Returns the lines that match the query, see match, with their character, scene number, episode and sentiment (sia_compound).
+
+        Parameters:
+        ----------
+        query : str
+            The words to find.
+        phrase : bool
+            Only return the lines with the words of the query in this order.
+        characters : list of str, optional
+            Only return the lines of these characters.
+
+        Returns:
+        -------
+        pandas.DataFrame
+            The matching lines, in the order of the script.
+        """
+        results = self.lines.iloc[self.match(query, phrase)]
+        if characters is not None:
+            results = results[results["f_char"].isin(characters)]
+        return results.reset_index(drop=True)
+
+    def sentiment_by_character(self, query, phrase=False, characters=None):
+        """
+        Returns the number of lines that match the query and their average sentiment (sia_compound) for every character.
+        """
+        results = self.search(query, phrase, characters)
+        return (results.groupby("f_char", observed=True)["sia_compound"].agg(num_lines="count", sentiment="mean")
+                .sort_values("num_lines", ascending=False).reset_index())
+
+    def sentiment_by_episode(self, query, phrase=False, characters=None):
+        """
+        Returns the number of lines that match the query and their average sentiment (sia_compound) for every episode.
+        """
+        results = self.search(query, phrase, characters)
+        return (results.groupby("episode", observed=True, sort=False)["sia_compound"].agg(num_lines="count", sentiment="mean")
+                .reset_index())
@@ -0,0 +1,376 @@
+# This file declares the VaderBatchScorer used by score_lines in downloading_and_cleaning_func.py to score many lines with VADER at once.
+# It gives exactly the same scores as SentimentIntensityAnalyzer.polarity_scores from nltk, but instead of running the rules of VADER token by token in Python,
+# the lines are split into tokens once, every distinct token is looked up in the lexicon once through an integer vocabulary, and the rules are applied to all the tokens with NumPy.
+#
+# Its scores can be checked against polarity_scores on every line of the transcript, or on random lines built from the rules of VADER when the transcript is not there, with:
+#   python -m python_scripts.vader_batch --transcript data/Friends_Transcript.txt
+#   python -m python_scripts.vader_batch --fuzz 50000
+import sys
+import random
+import string
+import argparse
+import numpy as np
+import pandas as pd
+
+# Version of the batch scorer, part of the name of the analyzer in the sentiment cache (SIA_ANALYZER in downloading_and_cleaning_func.py).
+# Increase it with every change to the scoring rules of VaderBatchScorer, so that the scores cached by a previous version are not reused.
+SCORER_VERSION = 1
+
+## Class declaration
+
+class VaderBatchScorer:
+    """
+    Scores lines with the rules of nltk's SentimentIntensityAnalyzer (lexicon valences, booster words, negations, ALL CAPS emphasis, "but", "least",
+    idioms and punctuation emphasis) using NumPy arrays instead of a Python loop over the tokens of every line.
+
+    The rules are reproduced including the quirks of nltk's implementation, e.g. a token that appears several times in a line is always scored
+    with the context of its first appearance, so that the scores are identical to the ones of polarity_scores.
+
+    Parameters:
+    ----------
+    sia : nltk.sentiment.vader.SentimentIntensityAnalyzer
+        The analyzer whose lexicon and constants are used.
+    """
+
+    PUNCTUATION = string.punctuation
+
+    def __init__(self, sia):
+        self.lexicon = sia.lexicon
+        self.constants = sia.constants
+        self.punc_list = set(self.constants.PUNC_LIST)
+        self.boosters = self.constants.BOOSTER_DICT
+        self.idioms = self.constants.SPECIAL_CASE_IDIOMS
+
+    def has_punctuation(self, word):
+        return any(c in self.PUNCTUATION for c in word)
+
+    def normalize_token(self, token):
+        """
+        Returns the token without the punctuation before or after it, like SentiText in nltk: the punctuation is only removed if it is one of the
+        signs of PUNC_LIST and what is left is a word of at least two characters without any punctuation.
+        """
+        stripped_start = token.lstrip(self.PUNCTUATION)
+        stripped_end = token.rstrip(self.PUNCTUATION)
+        if token[:len(token) - len(stripped_start)] in self.punc_list and len(stripped_start) > 1 and not self.has_punctuation(stripped_start):
+            return stripped_start
+        if token[len(stripped_end):] in self.punc_list and len(stripped_end) > 1 and not self.has_punctuation(stripped_end):
+            return stripped_end
+        return token
+
+    def tokenize(self, lines):
+        """
+        Splits every line into tokens, dropping single characters and removing the punctuation around words.
+        Every distinct token is only normalized once.
+
+        Returns:
+        -------
+        Tuple[numpy.ndarray, list of str, numpy.ndarray]
+            The vocabulary code of the tokens of all the lines one after the other, the vocabulary, and the number of tokens of every line.
+        """
+        raw_tokens = []
+        raw_lengths = np.empty(len(lines), dtype=np.int64)
+        for k, line in enumerate(lines):
+            words = line.split()
+            raw_tokens.extend(words)
+            raw_lengths[k] = len(words)
+        raw_codes, raw_vocabulary = pd.factorize(pd.Series(raw_tokens, dtype=object))
+
+        # Normalize the distinct tokens and map them to the vocabulary of normalized tokens, single characters are dropped
+        codes, vocabulary = pd.factorize(pd.Series([self.normalize_token(token) for token in raw_vocabulary], dtype=object))
+        kept = np.array([len(token) > 1 for token in raw_vocabulary], dtype=bool)[raw_codes]
+        lengths = np.bincount(np.repeat(np.arange(len(lines)), raw_lengths)[kept], minlength=len(lines))
+        return codes[raw_codes[kept]], list(vocabulary), lengths
+
+    def vocabulary_features(self, vocabulary):
+        """
+        Returns a dictionary of arrays with the properties of every distinct token used by the rules of VADER.
+        """
+        lowered = [token.lower() for token in vocabulary]
+        negate = self.constants.NEGATE
+        return {
+            "in_lexicon": np.array([token in self.lexicon for token in lowered], dtype=bool),
+            "valence": np.array([self.lexicon.get(token, 0.0) for token in lowered], dtype=np.float64),
+            "is_booster": np.array([token in self.boosters for token in lowered], dtype=bool),
+            "booster": np.array([self.boosters.get(token, 0.0) for token in lowered], dtype=np.float64),
+            "is_upper": np.array([token.isupper() for token in vocabulary], dtype=bool),
+            "negated": np.array([token in negate or "n't" in token for token in lowered], dtype=bool),
+            # Words compared in lowercase
+            "kind": np.array([token == "kind" for token in lowered], dtype=bool),
+            "of": np.array([token == "of" for token in lowered], dtype=bool),
+            "least": np.array([token == "least" for token in lowered], dtype=bool),
+            "at_very": np.array([token in ("at", "very") for token in lowered], dtype=bool),
+            "but": np.array([token == "but" for token in lowered], dtype=bool),
+            # Words compared as written
+            "never": np.array([token == "never" for token in vocabulary], dtype=bool),
+            "so_this": np.array([token in ("so", "this") for token in vocabulary], dtype=bool),
+        }
+
+    def polarity_scores(self, lines):
+        """
+        Scores every line like SentimentIntensityAnalyzer.polarity_scores.
+
+        Parameters:
+        ----------
+        lines : list of str
+            The lines to score.
+
+        Returns:
+        -------
+        numpy.ndarray
+            An array of shape (len(lines), 4) with the columns neg, neu, pos and compound of every line.
+        """
+        C_INCR = self.constants.C_INCR
+        N_SCALAR = self.constants.N_SCALAR
+
+        codes, vocabulary, lengths = self.tokenize(lines)
+        ids = {token: code for code, token in enumerate(vocabulary)}
+        features = self.vocabulary_features(vocabulary)
+
+        # Position of every token in the flat array, in its line, and number of tokens of its line
+        n_tokens = len(codes)
+        index = np.arange(n_tokens)
+        starts = np.cumsum(lengths) - lengths
+        line_of = np.repeat(np.arange(len(lines)), lengths)
+        position = index - starts[line_of]
+        line_length = lengths[line_of]
+
+        shifted_codes = {}
+        def shift(offset):
+            # Code of the token at 'offset' from every token, only meaningful where that token exists
+            if offset not in shifted_codes:
+                shifted_codes[offset] = codes[np.clip(index + offset, 0, max(n_tokens - 1, 0))]
+            return shifted_codes[offset]
+
+        def feature(name, offset=0):
+            return features[name][shift(offset)]
+
+        # A line has a "cap differential" when some, but not all, of its tokens are in ALL CAPS
+        upper_count = np.bincount(line_of, weights=feature("is_upper"), minlength=len(lines))
+        cap_diff = ((upper_count > 0) & (upper_count < lengths))[line_of]
+
+        # Booster words and the "kind" of "kind of" are not scored themselves, neither are words missing from the lexicon
+        skipped = feature("is_booster") | ((position < line_length - 1) & feature("kind") & feature("of", 1))
+        scored = feature("in_lexicon") & ~skipped
+        valence = feature("valence")
+
+        # Words in ALL CAPS are emphasized
+        capitalized = scored & feature("is_upper") & cap_diff
+        valence = np.where(capitalized, np.where(valence > 0, valence + C_INCR, valence - C_INCR), valence)
+
+        # Look at the three preceding tokens for boosters, negations and idioms
+        for start_i in range(3):
+            offset = -(start_i + 1)
+            applies = scored & (position > start_i) & ~feature("in_lexicon", offset)
+
+            # Booster or dampener words, with more weight when they are in ALL CAPS and less weight the further they are
+            booster = feature("booster", offset)
+            scalar = np.where(valence < 0, -booster, booster)
+            scalar = np.where(feature("is_upper", offset) & cap_diff, np.where(valence > 0, scalar + C_INCR, scalar - C_INCR), scalar)
+            scalar = np.where(feature("is_booster", offset), scalar, 0.0)
+            if start_i == 1:
+                scalar = np.where(scalar != 0, scalar * 0.95, scalar)
+            if start_i == 2:
+                scalar = np.where(scalar != 0, scalar * 0.9, scalar)
+            valence = np.where(applies, valence + scalar, valence)
+
+            # Negations, "never so" and "never this"
+            if start_i == 0:
+                valence = np.where(applies & feature("negated", -1), valence * N_SCALAR, valence)
+            elif start_i == 1:
+                never_so = feature("never", -2) & feature("so_this", -1)
+                valence = np.where(applies & never_so, valence * 1.5, np.where(applies & ~never_so & feature("negated", -2), valence * N_SCALAR, valence))
+            else:
+                never_so = (feature("never", -3) & feature("so_this", -2)) | feature("so_this", -1)
+                valence = np.where(applies & never_so, valence * 1.25, np.where(applies & ~never_so & feature("negated", -3), valence * N_SCALAR, valence))
+                valence = self.idioms_check(valence, applies, shift, ids, position, line_length)
+
+        # Negation with "least", except in "at least" and "very least"
+        least_before = ~feature("in_lexicon", -1) & feature("least", -1)
+        valence = np.where(scored & (position > 1) & least_before & ~feature("at_very", -2), valence * N_SCALAR, valence)
+        valence = np.where(scored & (position == 1) & least_before, valence * N_SCALAR, valence)
+        valence = np.where(scored, valence, 0.0)
+
+        # A token that appears several times in a line is scored with the context of its first appearance
+        key = line_of * max(len(vocabulary), 1) + codes
+        _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+        sentiments = valence[first[inverse.ravel()]]
+
+        # Words before the first "but" of a line count half, words after it count one and a half
+        but_position = np.full(len(lines), np.iinfo(np.int64).max)
+        is_but = feature("but")
+        np.minimum.at(but_position, line_of[is_but], position[is_but])
+        has_but = (but_position < np.iinfo(np.int64).max)[line_of]
+        but_position = but_position[line_of]
+        sentiments = np.where(has_but & (position < but_position), sentiments * 0.5, np.where(has_but & (position > but_position), sentiments * 1.5, sentiments))
+
+        # Add up the sentiments of every line in order, the same way as the Python loop so that the rounding is identical
+        sum_s = np.zeros(len(lines))
+        pos_sum = np.zeros(len(lines))
+        neg_sum = np.zeros(len(lines))
+        neu_count = np.zeros(len(lines))
+        # The lines are sorted from longest to shortest, so the lines that still have a k-th token are always the first ones
+        order = np.argsort(-lengths, kind="stable")
+        sorted_lengths = lengths[order]
+        for k in range(int(lengths.max()) if len(lines) else 0):
+            has_token = order[:np.searchsorted(-sorted_lengths, -k, side="left")]
+            values = sentiments[starts[has_token] + k]
+            sum_s[has_token] += values
+            pos_sum[has_token] += np.where(values > 0, values + 1, 0.0)
+            neg_sum[has_token] += np.where(values < 0, values - 1, 0.0)
+            neu_count[has_token] += values == 0
+
+        # Emphasis from exclamation points (up to 4) and question marks (2 or more)
+        exclamations = np.minimum(np.array([line.count("!") for line in lines], dtype=np.float64), 4)
+        questions = np.array([line.count("?") for line in lines], dtype=np.float64)
+        amplifier = exclamations * 0.292 + np.where(questions > 1, np.where(questions <= 3, questions * 0.18, 0.96), 0)
+
+        sum_s = np.where(sum_s > 0, sum_s + amplifier, np.where(sum_s < 0, sum_s - amplifier, sum_s))
+        compound = sum_s / np.sqrt(sum_s * sum_s + 15)
+
+        pos_larger = pos_sum > np.fabs(neg_sum)
+        neg_larger = pos_sum < np.fabs(neg_sum)
+        pos_sum = np.where(pos_larger, pos_sum + amplifier, pos_sum)
+        neg_sum = np.where(neg_larger, neg_sum - amplifier, neg_sum)
+        total = pos_sum + np.fabs(neg_sum) + neu_count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = np.column_stack([np.fabs(neg_sum / total), np.fabs(neu_count / total), np.fabs(pos_sum / total), compound])
+        scores[lengths == 0] = 0.0
+
+        # Round like polarity_scores
+        for column, digits in enumerate([3, 3, 3, 4]):
+            scores[:, column] = self.round_like_python(scores[:, column], digits)
+        return scores
+
+    @staticmethod
+    def round_like_python(values, digits):
+        """
+        Rounds an array like Python's round. np.round multiplies by a power of ten first, which can move a value that is very close to a tie
+        to the other side of it, so those values are rounded one by one with Python's round.
+        """
+        rounded = np.round(values, digits)
+        scaled = values * 10 ** digits
+        near_tie = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+        rounded[near_tie] = [round(value, digits) for value in values[near_tie].tolist()]
+        return rounded
+
+    def idioms_check(self, valence, applies, shift, ids, position, line_length):
+        """
+        Applies the idioms of SPECIAL_CASE_IDIOMS and the two word dampeners ("kind of", "sort of") around every token, like _idioms_check in nltk.
+        """
+        def matches(offsets, words):
+            # True for the tokens where the tokens at the offsets are exactly the words of the idiom
+            if any(word not in ids for word in words):
+                return np.zeros_like(applies)
+            found = applies.copy()
+            for offset, word in zip(offsets, words):
+                found &= (position + offset >= 0) & (position + offset < line_length) & (shift(offset) == ids[word])
+            return found
+
+        # The first of these sequences found in the idioms replaces the valence
+        sequences = [(-1, 0), (-2, -1, 0), (-2, -1), (-3, -2, -1), (-3, -2)]
+        replaced = np.zeros_like(applies)
+        idiom_valence = np.zeros_like(valence)
+        for offsets in sequences:
+            for idiom, value in self.idioms.items():
+                words = idiom.split(" ")
+                if len(words) == len(offsets):
+                    found = matches(offsets, words) & ~replaced
+                    idiom_valence = np.where(found, value, idiom_valence)
+                    replaced |= found
+        valence = np.where(replaced, idiom_valence, valence)
+
+        # Idioms starting at the token override the previous ones
+        for offsets in [(0, 1), (0, 1, 2)]:
+            for idiom, value in self.idioms.items():
+                words = idiom.split(" ")
+                if len(words) == len(offsets):
+                    valence = np.where(matches(offsets, words), value, valence)
+
+        # Two word dampeners before the token
+        dampened = np.zeros_like(applies)
+        for booster in self.boosters:
+            words = booster.split(" ")
+            if len(words) == 2:
+                dampened |= matches((-3, -2), words) | matches((-2, -1), words)
+        return np.where(dampened, valence + self.constants.B_DECR, valence)
+
+## Function declaration
+
+def fuzz_lines(sia, count, seed=0):
+    """
+    Returns random lines that exercise every rule of VADER: words of the lexicon, booster words, negations, idioms, "but", "least", "kind of",
+    words in ALL CAPS, emoticons, punctuation and words that are not in the lexicon. Used to check VaderBatchScorer without the transcript.
+
+    Parameters:
+    sia (SentimentIntensityAnalyzer): The analyzer whose lexicon and rules are used.
+    count (int): Number of lines.
+    seed (int): Seed of the random generator, the same seed always gives the same lines.
+
+    Returns:
+    list of str: The lines.
+    """
+    rng = random.Random(seed)
+    constants = sia.constants
+    lexicon = sorted(sia.lexicon)
+    boosters = sorted(constants.BOOSTER_DICT)
+    negations = sorted(constants.NEGATE)
+    idioms = sorted(constants.SPECIAL_CASE_IDIOMS)
+    special = ["but", "BUT", "least", "at least", "very least", "kind of", "never so", "never this", "without doubt", "no"]
+    fillers = ["the", "a", "you", "we", "I", "coffee", "Ross", "apartment", "today", "this", "is", "was", "it", "so"]
+    punctuation = ["", "", ".", "!", "!!", "!!!!!", "?", "??", "?!?", "...", ",", " :)", " :(", " ;)"]
+    groups = [(lexicon, 4), (boosters, 2), (negations, 2), (idioms, 1), (special, 1), (fillers, 4)]
+
+    lines = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(1, 14)):
+            group = rng.choices([group for group, _ in groups], weights=[weight for _, weight in groups])[0]
+            word = rng.choice(group)
+            # ALL CAPS emphasis, and words followed by punctuation
+            if rng.random() < 0.15:
+                word = word.upper()
+            elif rng.random() < 0.05:
+                word = word.capitalize()
+            if rng.random() < 0.1:
+                word += rng.choice(punctuation)
+            words.append(word)
+        lines.append(" ".join(words) + rng.choice(punctuation))
+    return lines
+
+def compare(sia, lines):
+    """
+    Scores the lines with both VaderBatchScorer and polarity_scores and returns the positions of the lines whose scores differ,
+    with the scores of both.
+    """
+    batch_scores = VaderBatchScorer(sia).polarity_scores(lines)
+    line_scores = np.array([[scores["neg"], scores["neu"], scores["pos"], scores["compound"]] for scores in map(sia.polarity_scores, lines)]).reshape(-1, 4)
+    different = np.flatnonzero((batch_scores != line_scores).any(axis=1))
+    return different, batch_scores, line_scores
+
+def main(argv=None):
+    """
+    Scores every line of the transcript, or random lines built with fuzz_lines, with both VaderBatchScorer and polarity_scores and reports the lines whose scores differ.
+    Returns 1 if any line differs, so it can be used as a check after upgrading nltk.
+    """
+    from python_scripts import downloading_and_cleaning_func as d_c
+
+    parser = argparse.ArgumentParser(description="Check that the batch VADER scores are identical to the ones of nltk's polarity_scores.")
+    parser.add_argument("--transcript", default="data/Friends_Transcript.txt", help="path of the script .txt file")
+    parser.add_argument("--fuzz", type=int, default=None, help="check this number of random lines instead of the transcript")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random lines")
+    args = parser.parse_args(argv)
+
+    sia = d_c.get_sia()
+    if args.fuzz is not None:
+        lines = fuzz_lines(sia, args.fuzz, args.seed)
+    else:
+        lines = d_c.read_script(args.transcript)["line"].astype(str).tolist()
+
+    different, batch_scores, line_scores = compare(sia, lines)
+    for i in different[:20]:
+        print(f"{lines[i]!r}: batch {batch_scores[i].tolist()}, polarity_scores {line_scores[i].tolist()}")
+    print(f"{len(different)} of {len(lines)} lines have different scores")
+    return 1 if len(different) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
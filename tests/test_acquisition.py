@@ -0,0 +1,143 @@
+# Tests of the downloads of acquisition.py against file:// URLs and a local HTTP server, without the network.
+# Run them from the root of the repo with: python -m pytest tests
+import os
+import hashlib
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from python_scripts import acquisition
+
+CONTENT = b"THE ONE WHERE MONICA GETS A ROOMMATE\n" * 5000
+ETAG = '"v1"'
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Serves CONTENT at /file with an ETag, answers conditional and Range requests, and can cut the body short or redirect to another server.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", server.redirect_to)
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == ETAG:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[start:]
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        # Send only part of the body and close the connection to simulate an interrupted download
+        if server.truncate:
+            server.truncate = False
+            self.wfile.write(body[:len(body) // 3])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, 0), FileHandler)
+    server.requests = []
+    server.truncate = False
+    server.redirect_to = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class AcquisitionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "transcript.txt")
+        self.manifest = os.path.join(self.folder.name, "downloads.json")
+        self.server = start_server()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/file"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.folder.cleanup()
+
+    def test_file_url_is_skipped_when_unchanged(self):
+        source_path = os.path.join(self.folder.name, "source.txt")
+        with open(source_path, "wb") as f:
+            f.write(CONTENT)
+        sources = [{"url": "file://" + urllib.request.pathname2url(source_path), "path": self.path}]
+
+        self.assertEqual(acquisition.acquire(sources, self.manifest), {self.path: True})
+        self.assertEqual(acquisition.acquire(sources, self.manifest), {self.path: False})
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_http_not_modified(self):
+        sources = [{"url": self.url, "path": self.path}]
+
+        self.assertEqual(acquisition.acquire(sources, self.manifest), {self.path: True})
+        self.assertEqual(acquisition.acquire(sources, self.manifest), {self.path: False})
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), ETAG)
+
+    def test_interrupted_download_is_resumed(self):
+        self.server.truncate = True
+        with self.assertRaises(OSError):
+            acquisition.fetch(self.url, self.path)
+        partial_size = os.path.getsize(self.path + ".part")
+        self.assertGreater(partial_size, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+        record, downloaded = acquisition.fetch(self.url, self.path, sha256=hashlib.sha256(CONTENT).hexdigest())
+        self.assertTrue(downloaded)
+        self.assertEqual(self.server.requests[-1].get("Range"), f"bytes={partial_size}-")
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertEqual(record["sha256"], hashlib.sha256(CONTENT).hexdigest())
+
+    def test_checksum_mismatch(self):
+        with self.assertRaises(acquisition.ChecksumError):
+            acquisition.fetch(self.url, self.path, sha256="0" * 64)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+        # A bad checksum is an OSError, like any other failed download
+        with self.assertRaises(OSError):
+            acquisition.acquire([{"url": self.url, "path": self.path, "sha256": "0" * 64}], self.manifest)
+
+    def test_authorization_is_dropped_on_redirect_to_another_host(self):
+        other = start_server()
+        try:
+            # Same server, but reached through another host name
+            self.server.redirect_to = f"http://localhost:{other.server_port}/file"
+            acquisition.fetch(f"http://127.0.0.1:{self.server.server_port}/redirect", self.path, headers={"Authorization": "Basic secret"})
+            self.assertEqual(self.server.requests[-1].get("Authorization"), "Basic secret")
+            self.assertNotIn("Authorization", other.requests[-1])
+        finally:
+            other.shutdown()
+            other.server_close()
+
+    def test_authorization_is_kept_on_redirect_to_the_same_host(self):
+        self.server.redirect_to = self.url
+        acquisition.fetch(f"http://127.0.0.1:{self.server.server_port}/redirect", self.path, headers={"Authorization": "Basic secret"})
+        self.assertEqual(self.server.requests[-1].get("Authorization"), "Basic secret")
+
+if __name__ == "__main__":
+    unittest.main()
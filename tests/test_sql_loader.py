@@ -0,0 +1,116 @@
+# Tests of the upload of sql_loader.py into a temporary SQLite file: row counts, indexes, rollup tables, the swap of the staging tables
+# and the query cache of analytics.py after an upload.
+# Run them from the root of the repo with: python -m pytest tests
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import sqlalchemy as alch
+from python_scripts import analytics, sql_loader
+
+def make_script(lines, characters=("Ross", "Rachel", "Monica")):
+    """
+    Returns a cleaned script with the given number of lines, spread over the characters and the scenes of make_scenes.
+    """
+    scores = np.linspace(-1, 1, lines, dtype=np.float32)
+    return pd.DataFrame({
+        "f_char": [characters[i % len(characters)] for i in range(lines)],
+        "f_line": [f"Line number {i}" for i in range(lines)],
+        "scene_number": [i % 4 for i in range(lines)],
+        "sia_neg": np.zeros(lines, dtype=np.float32),
+        "sia_neu": np.ones(lines, dtype=np.float32),
+        "sia_pos": np.zeros(lines, dtype=np.float32),
+        "sia_compound": scores,
+        "tb_polarity": scores,
+        "tb_subjectivity": np.full(lines, 0.5, dtype=np.float32),
+    })
+
+def make_scenes():
+    return pd.DataFrame({"scene_number": range(4), "episode": ["1", "1", "2", "2"], "scene": [f"Scene {i}" for i in range(4)]})
+
+def make_seasons():
+    seasons = pd.DataFrame({"ep_number_overall": ["1", "2"], "ep_number_season": [1, 2], "ep_title": ["The Pilot", "The One With The Sonogram"], "season": [1, 1]})
+    for column in sql_loader.seasons_columns():
+        if column.name not in seasons.columns and column.name != "id":
+            seasons[column.name] = None
+    return seasons
+
+class SqlLoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.engine = alch.create_engine(f"sqlite:///{os.path.join(self.folder.name, 'friends.sqlite')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.folder.cleanup()
+
+    def count(self, table):
+        with self.engine.connect() as connection:
+            return connection.execute(alch.text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+    def test_upload_row_counts(self):
+        sql_loader.upload_friends_info(self.engine, make_script(10), make_scenes(), make_seasons(), batch_size=3, rollups=False)
+        self.assertEqual(self.count("script"), 10)
+        self.assertEqual(self.count("scenes"), 4)
+        self.assertEqual(self.count("seasons"), 2)
+
+        # The staging tables are gone after the swap
+        tables = alch.inspect(self.engine).get_table_names()
+        self.assertFalse([table for table in tables if table.endswith("_staging")])
+
+    def test_indexes(self):
+        sql_loader.upload_friends_info(self.engine, make_script(10), make_scenes(), make_seasons(), rollups=False)
+        # Uploading again must recreate the indexes under the same names
+        sql_loader.upload_friends_info(self.engine, make_script(10), make_scenes(), make_seasons(), rollups=False)
+
+        inspector = alch.inspect(self.engine)
+        for name, columns in sql_loader.TABLE_INDEXES.items():
+            indexes = {index["name"]: index["column_names"] for index in inspector.get_indexes(name)}
+            self.assertEqual(indexes, {f"ix_{name}_{column}": [column] for column in columns})
+
+    def test_rollups(self):
+        friends_script = make_script(12)
+        sql_loader.upload_friends_info(self.engine, friends_script, make_scenes(), make_seasons())
+
+        with self.engine.connect() as connection:
+            by_character = pd.read_sql("SELECT * FROM sentiment_by_character ORDER BY f_char", connection)
+            by_season = pd.read_sql("SELECT * FROM sentiment_by_season", connection)
+            by_episode = pd.read_sql("SELECT * FROM sentiment_by_episode ORDER BY episode", connection)
+
+        expected = friends_script.groupby("f_char").agg(num_lines=("f_line", "count"), sentiment=("sia_compound", "mean")).reset_index()
+        self.assertEqual(by_character["f_char"].tolist(), expected["f_char"].tolist())
+        self.assertEqual(by_character["num_lines"].tolist(), expected["num_lines"].tolist())
+        np.testing.assert_allclose(by_character["sentiment"], expected["sentiment"], atol=1e-4)
+        self.assertEqual(by_season["num_lines"].tolist(), [12])
+        self.assertEqual(by_episode["num_lines"].tolist(), [6, 6])
+        self.assertEqual(by_episode["ep_title"].tolist(), ["The Pilot", "The One With The Sonogram"])
+
+    def test_failed_upload_keeps_the_previous_tables(self):
+        sql_loader.upload_friends_info(self.engine, make_script(10), make_scenes(), make_seasons(), batch_size=3)
+
+        # A line without a scene number breaks the NOT NULL constraint in the third batch of the script
+        broken = make_script(20).astype({"scene_number": object})
+        broken.loc[7, "scene_number"] = None
+        with self.assertRaises(alch.exc.IntegrityError):
+            sql_loader.upload_friends_info(self.engine, broken, make_scenes(), make_seasons(), batch_size=3)
+
+        self.assertEqual(self.count("script"), 10)
+        self.assertEqual(self.count("scenes"), 4)
+        self.assertEqual(self.count("seasons"), 2)
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(alch.text("SELECT SUM(num_lines) FROM sentiment_by_character")).scalar(), 10)
+        self.assertEqual(len(alch.inspect(self.engine).get_indexes("script")), len(sql_loader.TABLE_INDEXES["script"]))
+
+    def test_upload_invalidates_the_query_cache(self):
+        sql_loader.upload_friends_info(self.engine, make_script(10), make_scenes(), make_seasons())
+        before = analytics.run_query("sentiment_by_character", self.engine, characters=["Ross", "Rachel", "Monica"])
+
+        sql_loader.upload_friends_info(self.engine, make_script(20), make_scenes(), make_seasons())
+        after = analytics.run_query("sentiment_by_character", self.engine, characters=["Ross", "Rachel", "Monica"])
+        self.assertEqual(before["num_lines"].sum(), 10)
+        self.assertEqual(after["num_lines"].sum(), 20)
+
+if __name__ == "__main__":
+    unittest.main()
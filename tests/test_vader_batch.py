@@ -0,0 +1,28 @@
+# Checks that VaderBatchScorer gives exactly the scores of nltk's polarity_scores on random lines built from the rules of VADER, without the transcript.
+# Run it from the root of the repo with: python -m pytest tests
+import unittest
+import nltk
+from python_scripts import vader_batch
+
+class VaderBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            nltk.data.find("sentiment/vader_lexicon.zip")
+        except LookupError:
+            self.skipTest("the VADER lexicon is not installed")
+        from nltk.sentiment import SentimentIntensityAnalyzer
+        self.sia = SentimentIntensityAnalyzer()
+
+    def test_fuzzed_lines_have_the_same_scores(self):
+        lines = vader_batch.fuzz_lines(self.sia, 5000, seed=1)
+        different, batch_scores, line_scores = vader_batch.compare(self.sia, lines)
+        self.assertEqual([lines[i] for i in different[:5]], [])
+
+    def test_edge_cases(self):
+        lines = ["", "!!!", "GOOD", "not bad at all", "the shit", "kind of good", "good, but bad!!", "at least it's nice??", ":) :( ;)"]
+        different, _, _ = vader_batch.compare(self.sia, lines)
+        self.assertEqual([lines[i] for i in different], [])
+
+if __name__ == "__main__":
+    unittest.main()